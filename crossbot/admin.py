@@ -28,6 +28,9 @@ class UserSkillInline(admin.StackedInline):
     model = models.PredictionUser
     extra = 0
 
+    def get_queryset(self, request):
+        return self.model.current()
+
 
 # Adapted from: https://github.com/darklow/django-suit/issues/65#issuecomment-29606850
 class PaginatedInline(admin.TabularInline):
@@ -87,6 +90,7 @@ class CBUserAdmin(admin.ModelAdmin):
     list_display = (
         '__str__',
         'crossbucks',
+        'deactivated',
     )
     inlines = [
         UserSkillInline,
@@ -129,6 +133,7 @@ class CommonTimeAdminTemplate(admin.ModelAdmin):
 
 
 admin.site.register(models.QueryShorthand)
+admin.site.register(models.DataVersion)
 
 
 @admin.register(models.Prediction)
@@ -146,7 +151,30 @@ class PredictionAdmin(admin.ModelAdmin):
     def date(self, p):
         return p.time.date
 
-    list_filter = ('time__date', ('time__user', RelatedDropdownFilter))
+    list_filter = (
+        'run', 'time__date', ('time__user', RelatedDropdownFilter)
+    )
+
+
+@admin.register(models.PredictionRun)
+class PredictionRunAdmin(admin.ModelAdmin):
+    list_display = (
+        '__str__',
+        'started',
+        'finished',
+    )
+
+
+@admin.register(models.PredictionJob)
+class PredictionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        '__str__',
+        'created',
+        'started',
+        'finished',
+        'run',
+    )
+    list_filter = ('state', )
 
 
 @admin.register(models.PredictionUser)
@@ -167,7 +195,18 @@ class PredictionDateAdmin(admin.ModelAdmin):
         'difficulty_25',
         'difficulty_75',
     )
-    list_filter = ('date', )
+    list_filter = ('run', 'date')
 
 
 admin.site.register(models.PredictionParameter)
+
+
+@admin.register(models.SlackOutboxMessage)
+class SlackOutboxMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        '__str__',
+        'created',
+        'sent',
+        'attempts',
+    )
+    list_filter = ('state', 'kind')
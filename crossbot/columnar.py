@@ -0,0 +1,135 @@
+"""A compact, columnar encoding of a game's time history.
+
+The encoding is MAGIC, then the length of a JSON header as a little-endian
+uint32, then the header itself padded with spaces to a multiple of 4 bytes,
+then three little-endian int32 columns of the header's n values each:
+
+    user     index into the header's users (and names)
+    day      days since the header's epoch date
+    seconds  the time, negative for failures
+
+Since the columns start 4-byte aligned, a browser can read them with
+Int32Array and Python with array or numpy.frombuffer, without parsing.
+"""
+
+import datetime
+import json
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+from .models import CBUser
+
+MAGIC = b'CBT1'
+COLUMNS = ['user', 'day', 'seconds']
+
+_LENGTH = struct.Struct('<I')
+
+# The decoded form: users and names are lists indexed by the user column,
+# epoch is a date (None if there are no times), and the columns are arrays.
+Columns = namedtuple(
+    'Columns', ['timemodel', 'epoch', 'users', 'names'] + COLUMNS
+)
+
+
+def _int32s(values=()):
+    column = array('i', values)
+    assert column.itemsize == 4
+    return column
+
+
+def _little_endian(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def encode(timemodel, rows, names=None):
+    """Encodes rows of (user, date, seconds), ordered by date.
+
+    names maps users to display names; users without one are named by
+    themselves. Returns the encoding as bytes.
+    """
+    codes = {}
+    columns = {name: _int32s() for name in COLUMNS}
+    epoch = None
+    for user, date, seconds in rows:
+        if epoch is None:
+            epoch = date
+        columns['user'].append(codes.setdefault(user, len(codes)))
+        columns['day'].append((date - epoch).days)
+        columns['seconds'].append(seconds)
+
+    names = names or {}
+    header = json.dumps({
+        'timemodel': timemodel,
+        'epoch': epoch and epoch.isoformat(),
+        'users': list(codes),
+        'names': [names.get(user) or user for user in codes],
+        'n': len(columns['seconds']),
+        'columns': COLUMNS,
+        'dtype': '<i4',
+    }).encode()
+    header += b' ' * (-len(header) % 4)
+
+    return b''.join(
+        [MAGIC, _LENGTH.pack(len(header)), header] +
+        [_little_endian(columns[name]).tobytes() for name in COLUMNS]
+    )
+
+
+def export(game, timemodel):
+    """Encodes every time of a game (a CommonTime subclass)."""
+    names = CBUser.names_for(
+        game.all_times().values_list('user_id', flat=True).distinct()
+    )
+    rows = game.all_times().order_by('date', 'pk').values_list(
+        'user_id', 'date', 'seconds'
+    ).iterator(chunk_size=1000)
+    return encode(timemodel, rows, names)
+
+
+def decode(data):
+    """Decodes bytes made by encode into Columns."""
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a columnar times export')
+
+    offset = len(MAGIC) + _LENGTH.size
+    length, = _LENGTH.unpack_from(data, len(MAGIC))
+    header = json.loads(data[offset:offset + length].decode())
+    offset += length
+
+    n = header['n']
+    columns = {}
+    for name in header['columns']:
+        column = _int32s()
+        column.frombytes(data[offset:offset + 4 * n])
+        columns[name] = _little_endian(column)
+        offset += 4 * n
+
+    epoch = header['epoch']
+    return Columns(
+        timemodel=header['timemodel'],
+        epoch=epoch and datetime.datetime.strptime(epoch, '%Y-%m-%d').date(),
+        users=header['users'],
+        names=header['names'],
+        **columns
+    )
+
+
+def load(file):
+    """Reads Columns from a file name."""
+    with open(file, 'rb') as f:
+        return decode(f.read())
+
+
+def rows(columns):
+    """Yields (user, date, seconds) from Columns, like encode takes them."""
+    for user, day, seconds in zip(columns.user, columns.day, columns.seconds):
+        yield (
+            columns.users[user],
+            columns.epoch + datetime.timedelta(days=day),
+            seconds,
+        )
@@ -3,9 +3,12 @@ from django.utils import timezone
 
 from datetime import timedelta
 
+from crossbot.settings import PREDICTOR_WINDOW_DAYS
 from crossbot.util import comma_and
-from crossbot.models import MiniCrosswordTime, CBUser
+from crossbot.models import MiniCrosswordTime, CBUser, PredictionJob
 from crossbot.slack.api import post_message
+from crossbot.slack import outbox
+from crossbot.slack.commands.sql import refresh_snapshot
 import crossbot.predictor as predictor
 
 import logging
@@ -27,8 +30,8 @@ class ReleaseAnnouncement(CronJobBase):
         msgs = ['Good evening crossworders!']
         msgs += [
             '{u} is on a {n}-day win streak! {emoji}'.format(
-                u=u, n=len(streak), emoji=':fire:' * len(streak)
-            ) for u, streak in announce_data['streaks']
+                u=u, n=n, emoji=':fire:' * n
+            ) for u, n in announce_data['streaks']
         ]
 
         # now add the other winners
@@ -82,8 +85,8 @@ class MorningAnnouncement(CronJobBase):
 
         msgs += [
             '{u} is currently on a {n}-day win streak! {emoji}'.format(
-                u=u, n=len(streak), emoji=':fire:' * len(streak)
-            ) for u, streak in announce_data['streaks']
+                u=u, n=n, emoji=':fire:' * n
+            ) for u, n in announce_data['streaks']
         ]
 
         # now add the other winners
@@ -121,12 +124,29 @@ class Predictor(CronJobBase):
     code = 'crossbot.predictor.infer'
 
     def do(self):
-        data = predictor.data()
-        fit = predictor.fit(data, quiet=True)
-        model = predictor.extract_model(data, fit)
-        predictor.save(model)
-        historic, dates, users, params = model
-        return "Ran the predictor at {}".format(params.when_run)
+        # The fit itself is run by the predictor_worker command, so sampling
+        # doesn't hold up other cron jobs or compete with the web workers.
+        if PredictionJob.pending().exists():
+            return "Skipped the predictor, a job is already pending"
+
+        last = predictor.last_run()
+        if last and not predictor.changed_since(last.when_run):
+            return "Skipped the predictor, no new times since {}".format(
+                last.when_run
+            )
+
+        since = None
+        if last and PREDICTOR_WINDOW_DAYS:
+            # Keep fitting from the same date until the window is twice as
+            # long, so the priors fitted on the times before it are reused
+            window = timedelta(days=PREDICTOR_WINDOW_DAYS)
+            today = timezone.localdate()
+            since = last.run.since
+            if since is None or today - since >= 2 * window:
+                since = today - window
+
+        job = PredictionJob.enqueue(since=since, warm=last is not None)
+        return "Queued predictor job {}".format(job.pk)
 
 
 class SlacknameUpdater(CronJobBase):
@@ -135,5 +155,26 @@ class SlacknameUpdater(CronJobBase):
 
     def do(self):
         now = timezone.localtime()
-        CBUser.update_slacknames()
-        return "Updated slack_users at {}".format(now)
+        users = CBUser.update_slacknames()
+        return "Updated {} slack_users at {}".format(len(users), now)
+
+
+class SlackOutbox(CronJobBase):
+    schedule = Schedule(run_every_mins=5)
+    code = 'crossbot.slack_outbox'
+
+    def do(self):
+        # The web workers send their own messages, this only catches the
+        # ones left behind by a worker that stopped
+        sent = outbox.deliver_due()
+        outbox.prune()
+        return "Sent {} queued Slack messages".format(sent)
+
+
+class SqlSnapshot(CronJobBase):
+    schedule = Schedule(run_every_mins=1)
+    code = 'crossbot.sql_snapshot'
+
+    def do(self):
+        version = refresh_snapshot()
+        return "The sql snapshot is at version {}".format(version)
@@ -0,0 +1,87 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from crossbot.slack.handler import PARSER
+from crossbot.slack.parser import ParserException
+
+# Slash commands like the ones the test suite sends
+SAMPLE_COMMANDS = [
+    'add :10',
+    'add :10 2018-08-01',
+    'add fail 2018-08-01',
+    '-r add 1:05:10',
+    'delete 2018-08-01',
+    'times',
+    'plot',
+    'plot --start-date 2018-08-01',
+    'predictor details',
+    'query num_minis',
+    'query --save num_minis select count(*) from mini_crossword_time',
+    'sql select count(*) from mini_crossword_time',
+    'help',
+    'help add sql',
+    'add --help',
+    'asdfasdiufpasdfa',
+]
+
+
+def _parse_with(parse, string):
+    try:
+        parse(string)
+    except ParserException:
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Compare how long the slash command parser takes with and ' \
+        'without the precompiled dispatch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--number',
+            type=int,
+            default=1000,
+            help='How many times to parse each command.'
+        )
+        parser.add_argument(
+            'commands',
+            nargs='*',
+            default=SAMPLE_COMMANDS,
+            help='Commands to parse (by default, a sample of real ones).'
+        )
+
+    def handle(self, *args, **options):
+        number = options['number']
+
+        def full(string):
+            # What parsing did before the dispatch table: run the whole
+            # parser, and format help from scratch
+            args = PARSER.parser.parse_args(string.split())
+            if getattr(args, 'command', None) in (None, 'help'):
+                for cmd in getattr(args, 'help_subcommands', None) or []:
+                    _parse_with(PARSER.parser.parse_args, [cmd, '--help'])
+                PARSER.parser.format_help()
+
+        totals = [0, 0]
+        for string in options['commands']:
+            times = [
+                timeit.timeit(
+                    lambda: _parse_with(parse, string), number=number
+                ) / number for parse in (full, PARSER.parse)
+            ]
+            totals = [t + s for t, s in zip(totals, times)]
+            self.stdout.write(
+                '{:>9.1f}us {:>9.1f}us  {}'.format(
+                    times[0] * 1e6, times[1] * 1e6, string
+                )
+            )
+
+        self.stdout.write(
+            'full parse {:.1f}us, dispatch {:.1f}us per command ({:.1f}x)'.
+            format(
+                totals[0] * 1e6 / len(options['commands']),
+                totals[1] * 1e6 / len(options['commands']),
+                totals[0] / totals[1],
+            )
+        )
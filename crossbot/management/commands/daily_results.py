@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crossbot.models import CommonTime
+
+
+class Command(BaseCommand):
+    help = 'Backfill or verify the DailyResult and WinStreak tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only check the stored results against the times.'
+        )
+
+    def handle(self, *args, **options):
+        games = CommonTime.__subclasses__()
+
+        if not options['verify']:
+            for game in games:
+                game.rebuild_daily_results()
+                game.rebuild_win_streaks()
+                self.stdout.write(
+                    'Rebuilt {} daily results for {}'.format(
+                        game.daily_results().count(), game.PLURAL
+                    )
+                )
+            return
+
+        failed = False
+        for game in games:
+            bad_dates = game.check_daily_results()
+            if bad_dates:
+                failed = True
+                self.stdout.write(
+                    '{} has {} bad daily results: {}'.format(
+                        game.PLURAL, len(bad_dates),
+                        ', '.join(str(d) for d in bad_dates)
+                    )
+                )
+            else:
+                self.stdout.write('{} daily results OK'.format(game.PLURAL))
+
+        if failed:
+            raise CommandError('Daily results are out of date, rerun without '
+                               '--verify to rebuild them.')
@@ -0,0 +1,91 @@
+import datetime
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+
+from crossbot.models import CBUser, CommonTime, WinStreak
+
+# A full table scan, as opposed to "SCAN ... USING [COVERING] INDEX ..."
+FULL_SCAN_RX = re.compile(r'SCAN (TABLE )?(\w+)$')
+
+
+def hot_queries():
+    """Yields (name, queryset, may_scan) for the queries the app issues.
+
+    may_scan marks the queries that are expected to read the whole table,
+    like dumping every time for the REST API.
+    """
+    date = datetime.date.today()
+    user = CBUser(slackid='UEXPLAIN')
+
+    for game in CommonTime.__subclasses__():
+        prefix = game.SLUG + ': '
+
+        yield prefix + 'all_times', game.all_times().order_by('date'), True
+        yield prefix + 'times_for_date', game.times_for_date(date), False
+        yield prefix + 'get_time', game.objects.filter(
+            user=user, date=date, seconds__isnull=False, deleted=None
+        ), False
+        yield prefix + 'user times', user.times(game), False
+        yield prefix + 'plot range', game.all_times().filter(
+            date__gte=date - datetime.timedelta(days=7), date__lte=date
+        ).order_by('date', 'user__slackid'), False
+        yield prefix + 'winning_times', game.all_times().filter(
+            seconds__gt=0
+        ).values_list('date').annotate(models.Min('seconds')), True
+        yield prefix + 'winners', game.winning_entries(
+            game.times_for_date(date)
+        ), False
+        yield prefix + 'wins', game.winning_entries().filter(user=user), False
+        yield prefix + 'daily result', game.daily_results().filter(
+            date=date
+        ), False
+        yield prefix + 'current_win_streak', WinStreak.objects.filter(
+            game=game.SLUG,
+            user=user,
+            first_date__lte=date,
+            last_date__gte=date
+        ), False
+        yield prefix + 'current_win_streaks', WinStreak.objects.filter(
+            game=game.SLUG, first_date__lte=date, last_date__gte=date
+        ), False
+
+
+def explain(queryset):
+    """Returns the SQLite query plan for queryset as a list of lines."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'Print the SQLite query plan for each hot query the app issues.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Fail if a query unexpectedly does a full table scan.'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plans are only supported on SQLite.')
+
+        regressions = []
+        for name, queryset, may_scan in hot_queries():
+            plan = explain(queryset)
+            self.stdout.write(name)
+            for line in plan:
+                self.stdout.write('    ' + line)
+
+            scans = [line for line in plan if FULL_SCAN_RX.match(line)]
+            if scans and not may_scan:
+                regressions.append(name)
+
+        if options['check'] and regressions:
+            raise CommandError(
+                'Full table scans in: ' + ', '.join(regressions)
+            )
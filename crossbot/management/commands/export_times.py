@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from crossbot import columnar
+from crossbot.views import TIME_MODELS
+
+
+class Command(BaseCommand):
+    help = 'Save the time history of a game in the compact columnar ' \
+        'encoding, which the predictor can read back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--game',
+            choices=sorted(TIME_MODELS),
+            default='minicrossword',
+            help='Which game to export.'
+        )
+        parser.add_argument('file', help='Where to save the times.')
+
+    def handle(self, *args, **options):
+        data = columnar.export(TIME_MODELS[options['game']], options['game'])
+        with open(options['file'], 'wb') as f:
+            f.write(data)
+
+        self.stdout.write(
+            'Saved {} times to {} ({} bytes)'.format(
+                len(columnar.decode(data).seconds), options['file'], len(data)
+            )
+        )
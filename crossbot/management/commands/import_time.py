@@ -0,0 +1,87 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker imports before it can serve a request or run a cron job
+STARTUP_MODULES = ['crossbot.urls', 'crossbot.cron', 'crossbot.admin']
+
+# Modules that should only be imported when they're actually used
+HEAVY_MODULES = ['numpy', 'matplotlib', 'pystan']
+
+# Run in a fresh interpreter, so nothing is imported already
+SCRIPT = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'heavy': [name for name in %r if name in sys.modules],
+}))
+''' % HEAVY_MODULES
+
+
+def cold_start(modules):
+    """Imports modules in a new process, like a freshly started worker.
+
+    Returns (seconds, heavy), where heavy lists the HEAVY_MODULES that
+    were imported along the way.
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', SCRIPT] + modules,
+        cwd=settings.BASE_DIR,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    result = json.loads(output.decode().splitlines()[-1])
+    return result['seconds'], result['heavy']
+
+
+class Command(BaseCommand):
+    help = 'Time how long a new worker takes to set up and import the app.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of fresh processes to time.'
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Fail if starting up imports numpy, matplotlib or pystan.'
+        )
+        parser.add_argument(
+            'modules',
+            nargs='*',
+            default=STARTUP_MODULES,
+            help='Modules to import (by default, what a worker imports).'
+        )
+
+    def handle(self, *args, **options):
+        times, heavy = [], set()
+        for _ in range(options['repeat']):
+            seconds, imported = cold_start(options['modules'])
+            times.append(seconds)
+            heavy.update(imported)
+
+        self.stdout.write(
+            'Imported {} in {:.3f}s (median of {}, best {:.3f}s)'.format(
+                ', '.join(options['modules']), statistics.median(times),
+                len(times), min(times)
+            )
+        )
+        if heavy:
+            self.stdout.write('Also imported ' + ', '.join(sorted(heavy)))
+
+        if options['check'] and heavy:
+            raise CommandError(
+                'Startup imported heavy modules: ' + ', '.join(sorted(heavy))
+            )
@@ -0,0 +1,69 @@
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from crossbot import predictor
+from crossbot.models import PredictionJob
+from crossbot.settings import PREDICTOR_JOB_TIMEOUT_MINS
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run queued predictor jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the queued jobs, then exit instead of waiting for more.'
+        )
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=30,
+            help='Seconds to wait between checks for new jobs.'
+        )
+        parser.add_argument(
+            '--nice',
+            type=int,
+            default=10,
+            help='Lower the priority of the worker (and its samplers) by this '
+            'much, so sampling doesn\'t slow down requests.'
+        )
+
+    def handle(self, *args, **options):
+        if options['nice']:
+            os.nice(options['nice'])
+
+        # Make sure the model is compiled before claiming anything
+        predictor.get_model()
+
+        timeout = timedelta(minutes=PREDICTOR_JOB_TIMEOUT_MINS)
+        while True:
+            # Like a request would, drop connections that went bad or are
+            # past CONN_MAX_AGE while waiting
+            close_old_connections()
+            PredictionJob.fail_stale(timeout)
+            job = PredictionJob.claim()
+
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+                continue
+
+            self.stdout.write('Running {}'.format(job))
+            try:
+                run = predictor.run_job(job)
+            except Exception:
+                logger.exception('%s failed', job)
+                self.stderr.write('{} failed: {}'.format(job, job.error))
+            else:
+                self.stdout.write(
+                    'Finished {} in {} as {}'.format(job, job.duration, run)
+                )
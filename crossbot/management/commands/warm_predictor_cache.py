@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from crossbot import predictor, stan_cache
+
+
+class Command(BaseCommand):
+    help = 'Compile the predictor model into the cache, e.g. at deploy time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recompile the model even if it is already cached.'
+        )
+
+    def handle(self, *args, **options):
+        predictor.get_model(force=options['force'])
+        self.stdout.write(
+            'Cached predictor model in ' +
+            stan_cache.model_path(predictor.model_code())
+        )
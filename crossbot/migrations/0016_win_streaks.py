@@ -0,0 +1,95 @@
+# Generated by Django 2.2.10 on 2026-10-17 17:22
+
+import datetime
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+TIME_MODELS = {
+    'mini': 'MiniCrosswordTime',
+    'crossword': 'CrosswordTime',
+    'sudoku': 'EasySudokuTime',
+}
+
+
+def build_win_streaks(apps, schema_editor):
+    WinStreak = apps.get_model('crossbot', 'WinStreak')
+    one_day = datetime.timedelta(days=1)
+
+    for game, model_name in TIME_MODELS.items():
+        Time = apps.get_model('crossbot', model_name)
+        times = Time.objects.filter(deleted=None, seconds__gt=0)
+
+        winning_times = dict(
+            times.values_list('date').annotate(models.Min('seconds'))
+        )
+
+        win_dates = defaultdict(list)
+        for user_id, date, seconds in times.values_list(
+                'user_id', 'date', 'seconds').order_by('date'):
+            if seconds == winning_times[date]:
+                win_dates[user_id].append(date)
+
+        streaks = []
+        for user_id, dates in win_dates.items():
+            first = last = dates[0]
+            for date in dates[1:]:
+                if date != last + one_day:
+                    streaks.append(WinStreak(
+                        game=game,
+                        user_id=user_id,
+                        first_date=first,
+                        last_date=last,
+                    ))
+                    first = date
+                last = date
+            streaks.append(WinStreak(
+                game=game,
+                user_id=user_id,
+                first_date=first,
+                last_date=last,
+            ))
+
+        WinStreak.objects.bulk_create(streaks)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0015_cbuser_custom_title'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WinStreak',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID'
+                    )
+                ),
+                ('game', models.CharField(max_length=20)),
+                ('first_date', models.DateField()),
+                ('last_date', models.DateField()),
+                (
+                    'user',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='crossbot.CBUser'
+                    )
+                ),
+            ],
+            options={
+                'index_together': {('game', 'user', 'last_date')},
+            },
+        ),
+        migrations.RunPython(
+            build_win_streaks, migrations.RunPython.noop
+        ),
+    ]
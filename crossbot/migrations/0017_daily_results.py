@@ -0,0 +1,69 @@
+# Generated by Django 2.2.10 on 2026-10-17 17:23
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+TIME_MODELS = {
+    'mini': 'MiniCrosswordTime',
+    'crossword': 'CrosswordTime',
+    'sudoku': 'EasySudokuTime',
+}
+
+
+def build_daily_results(apps, schema_editor):
+    DailyResult = apps.get_model('crossbot', 'DailyResult')
+
+    for game, model_name in TIME_MODELS.items():
+        Time = apps.get_model('crossbot', model_name)
+        times = Time.objects.filter(deleted=None, seconds__gt=0)
+
+        winning_times = dict(
+            times.values_list('date').annotate(models.Min('seconds'))
+        )
+
+        winners = defaultdict(list)
+        for user_id, date, seconds in times.values_list(
+                'user_id', 'date', 'seconds'):
+            if seconds == winning_times[date]:
+                winners[date].append(user_id)
+
+        for date, seconds in winning_times.items():
+            result = DailyResult.objects.create(
+                game=game, date=date, winning_seconds=seconds
+            )
+            result.winners.set(winners[date])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0016_win_streaks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyResult',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID'
+                    )
+                ),
+                ('game', models.CharField(max_length=20)),
+                ('date', models.DateField()),
+                ('winning_seconds', models.IntegerField()),
+                ('winners', models.ManyToManyField(to='crossbot.CBUser')),
+            ],
+            options={
+                'unique_together': {('game', 'date')},
+            },
+        ),
+        migrations.RunPython(
+            build_daily_results, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 2.2.10 on 2026-10-17 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0017_daily_results'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='crosswordtime',
+            index=models.Index(
+                condition=models.Q(deleted=None),
+                fields=['date', 'user'],
+                name='crossword_live_date_user'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='crosswordtime',
+            index=models.Index(
+                condition=models.Q(('deleted', None), ('seconds__gt', 0)),
+                fields=['date', 'seconds'],
+                name='crossword_live_date_secs'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='easysudokutime',
+            index=models.Index(
+                condition=models.Q(deleted=None),
+                fields=['date', 'user'],
+                name='sudoku_live_date_user'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='easysudokutime',
+            index=models.Index(
+                condition=models.Q(('deleted', None), ('seconds__gt', 0)),
+                fields=['date', 'seconds'],
+                name='sudoku_live_date_secs'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='minicrosswordtime',
+            index=models.Index(
+                condition=models.Q(deleted=None),
+                fields=['date', 'user'],
+                name='mini_live_date_user'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='minicrosswordtime',
+            index=models.Index(
+                condition=models.Q(('deleted', None), ('seconds__gt', 0)),
+                fields=['date', 'seconds'],
+                name='mini_live_date_secs'
+            ),
+        ),
+    ]
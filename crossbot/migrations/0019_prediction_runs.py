@@ -0,0 +1,104 @@
+# Generated by Django 2.2.10 on 2026-10-17 17:30
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+RUN_MODELS = [
+    'Prediction', 'PredictionUser', 'PredictionDate', 'PredictionParameter'
+]
+
+
+def make_initial_run(apps, schema_editor):
+    """Put any existing predictions into a single, current run."""
+    PredictionRun = apps.get_model('crossbot', 'PredictionRun')
+    PredictionParameter = apps.get_model('crossbot', 'PredictionParameter')
+
+    if not any(
+            apps.get_model('crossbot', model_name).objects.exists()
+            for model_name in RUN_MODELS):
+        return
+
+    params = PredictionParameter.objects.order_by('-when_run').first()
+    finished = params.when_run if params else timezone.now()
+    run = PredictionRun.objects.create(finished=finished)
+
+    for model_name in RUN_MODELS:
+        apps.get_model('crossbot', model_name).objects.update(run=run)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0018_time_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionRun',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID'
+                    )
+                ),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                (
+                    'finished',
+                    models.DateTimeField(
+                        blank=True, default=None, null=True
+                    )
+                ),
+            ],
+        ),
+    ] + [
+        migrations.AddField(
+            model_name=model_name.lower(),
+            name='run',
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to='crossbot.PredictionRun'
+            ),
+        ) for model_name in RUN_MODELS
+    ] + [
+        migrations.RunPython(make_initial_run, migrations.RunPython.noop),
+    ] + [
+        migrations.AlterField(
+            model_name=model_name.lower(),
+            name='run',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                to='crossbot.PredictionRun'
+            ),
+        ) for model_name in RUN_MODELS
+    ] + [
+        migrations.AlterField(
+            model_name='prediction',
+            name='time',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                to='crossbot.MiniCrosswordTime'
+            ),
+        ),
+        migrations.AlterField(
+            model_name='predictionuser',
+            name='user',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                to='crossbot.CBUser'
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name='prediction',
+            unique_together={('run', 'time')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='predictionuser',
+            unique_together={('run', 'user')},
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 2.2.10 on 2026-10-17 17:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0019_prediction_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionJob',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID'
+                    )
+                ),
+                (
+                    'state',
+                    models.CharField(
+                        choices=[('queued', 'Queued'), ('running', 'Running'),
+                                 ('finished', 'Finished'),
+                                 ('failed', 'Failed')],
+                        default='queued',
+                        max_length=10
+                    )
+                ),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                (
+                    'started',
+                    models.DateTimeField(
+                        blank=True, default=None, null=True
+                    )
+                ),
+                (
+                    'finished',
+                    models.DateTimeField(
+                        blank=True, default=None, null=True
+                    )
+                ),
+                (
+                    'since',
+                    models.DateField(blank=True, default=None, null=True)
+                ),
+                ('warm', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True, default='')),
+                (
+                    'run',
+                    models.ForeignKey(
+                        blank=True,
+                        default=None,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to='crossbot.PredictionRun'
+                    )
+                ),
+            ],
+        ),
+    ]
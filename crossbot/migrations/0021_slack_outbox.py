@@ -0,0 +1,87 @@
+# Generated by Django 2.2.10 on 2026-10-17 17:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0020_prediction_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlackOutboxMessage',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID'
+                    )
+                ),
+                (
+                    'kind',
+                    models.CharField(
+                        choices=[('post', 'Post message'),
+                                 ('react', 'Add reaction'),
+                                 ('response', 'Post response')],
+                        max_length=10
+                    )
+                ),
+                ('key', models.CharField(max_length=255)),
+                ('payload', models.TextField()),
+                (
+                    'ts',
+                    models.CharField(
+                        blank=True, default=None, max_length=40, null=True
+                    )
+                ),
+                (
+                    'state',
+                    models.CharField(
+                        choices=[('pending', 'Pending'), ('sending', 'Sending'),
+                                 ('sent', 'Sent'), ('failed', 'Failed')],
+                        default='pending',
+                        max_length=10
+                    )
+                ),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                (
+                    'claimed',
+                    models.DateTimeField(
+                        blank=True, default=None, null=True
+                    )
+                ),
+                (
+                    'sent',
+                    models.DateTimeField(
+                        blank=True, default=None, null=True
+                    )
+                ),
+                ('attempts', models.IntegerField(default=0)),
+                (
+                    'next_attempt',
+                    models.DateTimeField(default=django.utils.timezone.now)
+                ),
+                ('error', models.TextField(blank=True, default='')),
+                (
+                    'parent',
+                    models.ForeignKey(
+                        blank=True,
+                        default=None,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='crossbot.SlackOutboxMessage'
+                    )
+                ),
+            ],
+            options={
+                'index_together': {('state', 'key')},
+            },
+        ),
+    ]
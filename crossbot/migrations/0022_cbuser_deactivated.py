@@ -0,0 +1,18 @@
+# Generated by Django 2.2.10 on 2026-10-17 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0021_slack_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cbuser',
+            name='deactivated',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.10 on 2026-10-17 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0022_cbuser_deactivated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                (
+                    'game',
+                    models.CharField(
+                        max_length=20, primary_key=True, serialize=False
+                    )
+                ),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.10 on 2026-10-17 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crossbot', '0023_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictionrun',
+            name='since',
+            field=models.DateField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='predictionuser',
+            name='prior_skill',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='predictionuser',
+            name='prior_skill_sd',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+    ]
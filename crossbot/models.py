@@ -1,22 +1,27 @@
 """Crossbot Django models."""
 
+import copy
 import datetime
 import logging
 import random
 
+from collections import defaultdict
 from operator import attrgetter
 from os import path
 
 import yaml
 
-from crossbot.util import comma_and
+from crossbot.util import comma_and, LRUCache
 
 from django.contrib.auth.models import User
 from django.contrib.staticfiles.templatetags.staticfiles import static
 from django.db import models, transaction
 from django.utils import timezone
 
-from .settings import CROSSBUCKS_PER_SOLVE, ITEM_DROP_RATE, DEFAULT_TITLE
+from .settings import (
+    CROSSBUCKS_PER_SOLVE, ITEM_DROP_RATE, DEFAULT_TITLE, USER_CACHE_SIZE,
+    USER_CACHE_TTL
+)
 from crossbot.slack.api import slack_users, slack_user
 
 logger = logging.getLogger(__name__)
@@ -36,6 +41,8 @@ class CBUser(models.Model):
     slackname = models.CharField(max_length=100, blank=True)
     slack_fullname = models.CharField(max_length=100, blank=True)
     image_url = models.CharField(max_length=150, blank=True)
+    # When the user was found to be deactivated or gone from Slack
+    deactivated = models.DateTimeField(null=True, blank=True, default=None)
 
     crossbucks = models.IntegerField(default=0)
     hat_key = models.CharField(max_length=40, null=True, blank=True)
@@ -50,16 +57,39 @@ class CBUser(models.Model):
         related_name='cb_user'
     )
 
+    # slackid -> display name, or None for unknown slackids. Each process
+    # has its own, so other processes' changes show up after USER_CACHE_TTL.
+    _names = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+    # slackid -> CBUser, like _names. Only users read from the database are
+    # cached, so a user created in a transaction that rolls back isn't.
+    _users = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
     @classmethod
-    @transaction.atomic
     def from_slackid(cls, slackid, slackname=None):
-        """Gets or creates the user with slackid, updating slackname."""
+        """Gets or creates the user with slackid, updating slackname.
+
+        Each call returns its own copy of the cached user, so callers can
+        change it freely.
+        """
+        user = cls._users.get(slackid)
+        if user is None:
+            user = cls.objects.filter(slackid=slackid).first()
+            if user is None:
+                return cls._create_from_slackid(slackid, slackname)
+            cls._users.set(slackid, copy.deepcopy(user))
+        else:
+            user = copy.deepcopy(user)
+
+        if slackname is not None and user.slackname != slackname:
+            user.slackname = slackname
+            user.save(update_fields=['slackname'])
+        return user
+
+    @classmethod
+    @transaction.atomic
+    def _create_from_slackid(cls, slackid, slackname=None):
         try:
-            user = cls.objects.get(slackid=slackid)
-            if slackname is not None and user.slackname != slackname:
-                user.slackname = slackname
-                user.save()
-            return user
+            return cls.objects.get(slackid=slackid)
 
         except cls.DoesNotExist:
             try:
@@ -81,16 +111,90 @@ class CBUser(models.Model):
             return user
 
     @classmethod
-    def update_slacknames(cls):
-        users = {u['id']: u for u in slack_users()}
+    def names_for(cls, slackids):
+        """Returns a dict from each known slackid in slackids to its name.
 
-        for user in cls.objects.all():
-            u = users[user.slackid]
-            user.slackname = u['name']
-            user.slack_fullname = u['profile']['real_name']
+        Names are cached, and the ones that aren't are looked up in a single
+        query. Unlike from_slackid, unknown slackids aren't looked up in
+        Slack.
+        """
+        names, missing = {}, set()
+        for slackid in set(slackids):
+            name = cls._names.get(slackid, default=False)
+            if name is False:
+                missing.add(slackid)
+            elif name is not None:
+                names[slackid] = name
+
+        if missing:
+            for user in cls.objects.filter(slackid__in=missing).only(
+                    'slackid', 'slackname', 'slack_fullname'):
+                names[user.slackid] = str(user)
+            for slackid in missing:
+                cls._names.set(slackid, names.get(slackid))
+
+        return names
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        CBUser._names.invalidate(self.slackid)
+        CBUser._users.invalidate(self.slackid)
+
+    # Fields kept in sync with Slack by update_slacknames
+    SLACK_FIELDS = ('slackname', 'slack_fullname', 'image_url', 'deactivated')
+
+    @staticmethod
+    def slack_fields(member, deactivated):
+        """The SLACK_FIELDS values for a users.list member."""
+        profile = member.get('profile', {})
+        return (
+            member.get('name', ''),
+            profile.get('real_name', ''),
             # image size options: 24 32 48 72 192 512 1024
-            user.image_url = u['profile']['image_48']
-            user.save()
+            profile.get('image_48', ''),
+            deactivated if member.get('deleted') else None,
+        )
+
+    @classmethod
+    def update_slacknames(cls):
+        """Sync users' names and pictures with the Slack directory.
+
+        Only the users that changed are saved. Users that were deactivated,
+        or are missing from the workspace, are marked deactivated.
+
+        Returns the list of updated users.
+        """
+        now = timezone.now()
+        current = {
+            u[0]: u[1:]
+            for u in cls.objects.values_list('slackid', *cls.SLACK_FIELDS)
+        }
+
+        changed = {}
+        for member in slack_users():
+            old = current.pop(member['id'], None)
+            if old is None:
+                continue
+
+            new = cls.slack_fields(member, deactivated=old[-1] or now)
+            if new != old:
+                changed[member['id']] = new
+
+        # Whoever is left has left the workspace
+        for slackid, old in current.items():
+            if old[-1] is None:
+                changed[slackid] = old[:-1] + (now, )
+
+        users = [
+            cls(slackid=slackid, **dict(zip(cls.SLACK_FIELDS, fields)))
+            for slackid, fields in changed.items()
+        ]
+        cls.objects.bulk_update(users, cls.SLACK_FIELDS, batch_size=200)
+        # invalidate() with no keys would clear the whole cache
+        if changed:
+            cls._names.invalidate(*changed)
+            cls._users.invalidate(*changed)
+        return users
 
     @classmethod
     def do_all_completed(cls):
@@ -144,6 +248,8 @@ class CBUser(models.Model):
             return (False, time)
 
         time = time_model.objects.create(user=self, date=date, seconds=seconds)
+        time_model.update_daily_result(date)
+        time_model.update_win_streaks(date)
 
         # Give the user crossbucks
         self.refresh_from_db()  # refresh this object inside the transaction
@@ -175,6 +281,8 @@ class CBUser(models.Model):
         assert time.deleted is None
         time.deleted = timezone.now()
         time.save()
+        time_model.update_daily_result(date)
+        time_model.update_win_streaks(date)
 
         # Take away crossbucks from the user
         self.refresh_from_db()  # refresh this object inside the transaction
@@ -370,6 +478,15 @@ class CommonTime(models.Model):
     timestamp = models.DateTimeField(null=True, auto_now_add=True)
     deleted = models.DateTimeField(null=True, blank=True, default=None)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        DataVersion.bump(self.SLUG)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        DataVersion.bump(self.SLUG)
+        return result
+
     @classmethod
     def all_times(cls):
         return cls.objects.filter(deleted=None)
@@ -449,66 +566,180 @@ class CommonTime(models.Model):
 
         return '\n'.join(msgs)
 
+    @classmethod
+    def daily_results(cls):
+        """Returns a QuerySet of the DailyResults for this game."""
+        return DailyResult.objects.filter(game=cls.SLUG)
+
     @classmethod
     def winning_times(cls, qs=None):
         if qs is None:
-            qs = cls.all_times().filter(seconds__gt=0)
-        values = qs.values_list('date').annotate(
-            winning_time=models.Min('seconds')
-        )
+            values = cls.daily_results().values_list(
+                'date', 'winning_seconds'
+            )
+        else:
+            values = qs.filter(seconds__gt=0).values_list('date').annotate(
+                winning_time=models.Min('seconds')
+            )
 
         return {date: winning_time for date, winning_time in values}
 
+    @classmethod
+    def winning_entries(cls, qs=None):
+        """Filters qs down to the times that won their day."""
+        if qs is None:
+            qs = cls.all_times()
+        winning_seconds = cls.daily_results().filter(
+            date=models.OuterRef('date')
+        ).values('winning_seconds')
+        return qs.filter(seconds=models.Subquery(winning_seconds))
+
     @classmethod
     def winners(cls, date):
-        entries = cls.times_for_date(date)
-        try:
-            best = min(e.seconds for e in entries if e.seconds > 0)
-            winners = [e for e in entries if e.seconds == best]
-            # if there was a best, there must be a winner
-            assert winners
-            return winners
-        except ValueError as e:
-            # entries was empty
-            return []
+        return list(cls.winning_entries(cls.times_for_date(date)))
 
     @classmethod
     def wins(cls, user, qs=None):
-        if qs is None:
-            qs = cls.all_times()
-        qs = qs.filter(seconds__gt=0, user=user)
-        wins = cls.winning_times()
-        return [e for e in qs if e.seconds == wins[e.date]]
+        return list(cls.winning_entries(qs).filter(user=user).order_by('date'))
+
+    @classmethod
+    def update_daily_result(cls, date):
+        """Refresh the DailyResult for date from the times on that date."""
+        entries = cls.times_for_date(date).filter(seconds__gt=0)
+        best = entries.aggregate(best=models.Min('seconds'))['best']
+
+        if best is None:
+            cls.daily_results().filter(date=date).delete()
+            return None
+
+        result, _ = DailyResult.objects.update_or_create(
+            game=cls.SLUG, date=date, defaults={'winning_seconds': best}
+        )
+        result.winners.set(
+            entries.filter(seconds=best).values_list('user', flat=True)
+        )
+        return result
+
+    @classmethod
+    @transaction.atomic
+    def rebuild_daily_results(cls):
+        """Recompute the DailyResult table for this game from scratch."""
+        cls.daily_results().delete()
+        for date in cls.all_times().values_list('date', flat=True).distinct():
+            cls.update_daily_result(date)
+
+    @classmethod
+    def check_daily_results(cls):
+        """Compare the DailyResult table against the times it summarizes.
+
+        Returns:
+            A list of dates whose stored result is missing, stale, or has no
+            winning times left.
+        """
+        expected = cls.winning_times(cls.all_times())
+        stored = {
+            r.date: (r.winning_seconds, set(u.pk for u in r.winners.all()))
+            for r in cls.daily_results().prefetch_related('winners')
+        }
+
+        expected_winners = defaultdict(set)
+        for e in cls.winning_entries().filter(date__in=expected.keys()):
+            expected_winners[e.date].add(e.user_id)
+
+        bad_dates = []
+        for date in sorted(set(expected) | set(stored)):
+            if date not in expected or date not in stored:
+                bad_dates.append(date)
+                continue
+            seconds, winners = stored[date]
+            if seconds != expected[date] or winners != expected_winners[date]:
+                bad_dates.append(date)
+
+        return bad_dates
 
     @classmethod
     def win_streaks(cls, user, qs=None):
         wins = cls.wins(user, qs)
         return cls.streaks(wins)
 
+    @classmethod
+    def current_win_streak(cls, user, date):
+        """Returns the WinStreak for user that covers date, or None."""
+        try:
+            return WinStreak.objects.get(
+                game=cls.SLUG,
+                user=user,
+                first_date__lte=date,
+                last_date__gte=date
+            )
+        except WinStreak.DoesNotExist:
+            return None
+
     @classmethod
     # TODO: should this take a date or a timestamp?
     def current_win_streaks(cls, date):
+        """Returns a dict from each user who won on date to the length of
+        their win streak up to date, read from the WinStreak table."""
         if isinstance(date, datetime.datetime):
             # convert to just a date for comparison to dates in the db
             date = date.date()
-        result = {}
-        # get the win streaks up to this date
-        qs = cls.all_times().filter(date__lte=date)
-        for w in cls.winners(date):
-            streaks = cls.win_streaks(w.user, qs)
-            latest_streak = streaks[-1]
-            # only include the streak if it comes up to this day
-            if latest_streak[-1].date == date:
-                result[w.user] = latest_streak
-        return result
+        streaks = WinStreak.objects.filter(
+            game=cls.SLUG, first_date__lte=date, last_date__gte=date
+        ).select_related('user')
+        # only count the streak up to this day
+        return {streak.user: streak.length(date) for streak in streaks}
+
+    @classmethod
+    def update_win_streaks(cls, date):
+        """Bring the WinStreak table up to date after a time on date changed.
+
+        Only the winners of date can change, so this diffs the users recorded
+        as winning on date against the actual winners and splits or merges
+        their streaks around date.
+        """
+        recorded = set(
+            WinStreak.objects.filter(
+                game=cls.SLUG, first_date__lte=date, last_date__gte=date
+            ).values_list('user_id', flat=True)
+        )
+        actual = set(
+            cls.daily_results().filter(date=date)
+            .values_list('winners', flat=True).exclude(winners=None)
+        )
+
+        for user_id in recorded - actual:
+            WinStreak.remove_win(cls.SLUG, user_id, date)
+        for user_id in actual - recorded:
+            WinStreak.add_win(cls.SLUG, user_id, date)
+
+    @classmethod
+    @transaction.atomic
+    def rebuild_win_streaks(cls):
+        """Recompute the WinStreak table for this game from scratch.
+
+        Relies on the DailyResult table, so rebuild that first if in doubt.
+        """
+        WinStreak.objects.filter(game=cls.SLUG).delete()
+        users = CBUser.objects.filter(
+            slackid__in=cls.all_times().values('user')
+        )
+        for user in users:
+            WinStreak.objects.bulk_create(
+                WinStreak(
+                    game=cls.SLUG,
+                    user=user,
+                    first_date=streak[0].date,
+                    last_date=streak[-1].date,
+                ) for streak in cls.win_streaks(user)
+            )
 
     @classmethod
     def announcement_data(cls, date):
-        streaks = [(u, s)
-                   for u, s in cls.current_win_streaks(date).items()
-                   if len(s) > 1]
+        streaks = [(u, n)
+                   for u, n in cls.current_win_streaks(date).items()
+                   if n > 1]
         # sort by streak length, descending
-        streaks.sort(key=lambda x: len(x[1]), reverse=True)
+        streaks.sort(key=lambda x: x[1], reverse=True)
         streakers = set(u for u, s in streaks)
 
         # get the winners who were not included in the long streaks
@@ -521,11 +752,11 @@ class CommonTime(models.Model):
         ]
 
         overperformers = [
-            (str(m.time.user), m.residual) for m in Prediction.objects
+            (str(m.time.user), m.residual) for m in Prediction.current()
             .filter(time__date=date, residual__lte=0).order_by('residual')[:3]
         ]
         try:
-            difficulty = PredictionDate.objects.get(date=date).difficulty
+            difficulty = PredictionDate.current().get(date=date).difficulty
         except PredictionDate.DoesNotExist:
             difficulty = 0
 
@@ -550,11 +781,11 @@ class CommonTime(models.Model):
     def announcement_message(cls, date):
 
         # get the long streaks
-        streaks = [(u, s)
-                   for u, s in cls.current_win_streaks(date).items()
-                   if len(s) > 1]
+        streaks = [(u, n)
+                   for u, n in cls.current_win_streaks(date).items()
+                   if n > 1]
         # sort by streak length, descending
-        streaks.sort(key=lambda x: len(x[1]), reverse=True)
+        streaks.sort(key=lambda x: x[1], reverse=True)
         streakers = set(u for u, s in streaks)
 
         # get the winners who were not included in the long streaks
@@ -569,8 +800,8 @@ class CommonTime(models.Model):
         # start with the streak messages
         msgs = [
             '{u} is on a {n}-day streak! {emoji}'.format(
-                u=u, n=len(streak), emoji=':fire:' * len(streak)
-            ) for u, streak in streaks
+                u=u, n=n, emoji=':fire:' * n
+            ) for u, n in streaks
         ]
 
         # now add the other winners
@@ -604,48 +835,389 @@ class CommonTime(models.Model):
         return cls.streaks(times)
 
 
+def time_indexes(prefix):
+    """Partial indexes for the hot queries on a CommonTime subclass.
+
+    Index names are global in SQLite, so each subclass needs its own prefix.
+    The unique_together index already covers lookups by (user, date).
+    """
+    live = models.Q(deleted=None)
+    return [
+        # times_for_date, and the date range scans ordered by user in plot
+        models.Index(
+            fields=['date', 'user'],
+            name=prefix + '_live_date_user',
+            condition=live,
+        ),
+        # winning times and winners, grouped or filtered by date
+        models.Index(
+            fields=['date', 'seconds'],
+            name=prefix + '_live_date_secs',
+            condition=live & models.Q(seconds__gt=0),
+        ),
+    ]
+
+
 class MiniCrosswordTime(CommonTime):
+    class Meta(CommonTime.Meta):
+        indexes = time_indexes('mini')
+
     SHORT_NAME = 'Mini'
     SLUG = 'mini'
     PLURAL = 'mini crosswords'
-    pass
 
 
 class CrosswordTime(CommonTime):
+    class Meta(CommonTime.Meta):
+        indexes = time_indexes('crossword')
+
     SHORT_NAME = 'Crossword'
     SLUG = 'crossword'
     PLURAL = 'regular crosswords'
-    pass
 
 
 class EasySudokuTime(CommonTime):
+    class Meta(CommonTime.Meta):
+        indexes = time_indexes('sudoku')
+
     SHORT_NAME = 'Sudoku'
     SLUG = 'sudoku'
     PLURAL = 'sudokus'
-    pass
 
 
-class Prediction(models.Model):
-    time = models.OneToOneField(MiniCrosswordTime, on_delete=models.CASCADE)
+class DailyResult(models.Model):
+    """The winning time and winners of a game on a single date.
+
+    Denormalized from the time tables and kept up to date by
+    CBUser.add_time and CBUser.remove_time, so that finding winners is a
+    point lookup instead of a scan over the day (or the whole history).
+    """
+
+    class Meta:
+        unique_together = (('game', 'date'), )
+
+    game = models.CharField(max_length=20)
+    date = models.DateField()
+    winning_seconds = models.IntegerField()
+    winners = models.ManyToManyField(CBUser)
+
+    def __str__(self):
+        return '{} - {} - {}'.format(self.game, self.date, self.winning_seconds)
+
+
+class WinStreak(models.Model):
+    """A maximal run of consecutive days on which a user won a game.
+
+    Maintained incrementally by CBUser.add_time and CBUser.remove_time, so
+    looking up someone's current streak doesn't rescan the whole history.
+    """
+
+    class Meta:
+        index_together = (('game', 'user', 'last_date'), )
+
+    game = models.CharField(max_length=20)
+    user = models.ForeignKey(CBUser, on_delete=models.CASCADE)
+    first_date = models.DateField()
+    last_date = models.DateField()
+
+    def length(self, date=None):
+        """Number of days in this streak, counting only up to date if given."""
+        last_date = self.last_date if date is None else min(
+            date, self.last_date
+        )
+        return (last_date - self.first_date).days + 1
+
+    @classmethod
+    def add_win(cls, game, user_id, date):
+        """Record a win on date, extending or joining adjacent streaks."""
+        one_day = datetime.timedelta(days=1)
+        streaks = cls.objects.filter(game=game, user_id=user_id)
+        before = streaks.filter(last_date=date - one_day).first()
+        after = streaks.filter(first_date=date + one_day).first()
+
+        if before and after:
+            before.last_date = after.last_date
+            after.delete()
+            before.save()
+        elif before:
+            before.last_date = date
+            before.save()
+        elif after:
+            after.first_date = date
+            after.save()
+        else:
+            cls.objects.create(
+                game=game, user_id=user_id, first_date=date, last_date=date
+            )
+
+    @classmethod
+    def remove_win(cls, game, user_id, date):
+        """Forget a win on date, shrinking or splitting its streak."""
+        one_day = datetime.timedelta(days=1)
+        streak = cls.objects.get(
+            game=game,
+            user_id=user_id,
+            first_date__lte=date,
+            last_date__gte=date
+        )
+
+        if streak.first_date == streak.last_date:
+            streak.delete()
+            return
+
+        if streak.first_date == date:
+            streak.first_date += one_day
+        elif streak.last_date == date:
+            streak.last_date -= one_day
+        else:
+            cls.objects.create(
+                game=game,
+                user_id=user_id,
+                first_date=date + one_day,
+                last_date=streak.last_date
+            )
+            streak.last_date = date - one_day
+        streak.save()
+
+    def __str__(self):
+        return '{} - {} win streak {} to {}'.format(
+            self.user, self.game, self.first_date, self.last_date
+        )
+
+
+class DataVersion(models.Model):
+    """A counter for each game that goes up whenever its times change.
+
+    Bumped whenever a time is saved or deleted (as by CBUser.add_time and
+    CBUser.remove_time), so anything computed from the times can be cached
+    until the version changes.
+    """
+    game = models.CharField(max_length=20, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def bump(cls, game):
+        """Increment game's version. Call it in the transaction that
+        changes the times."""
+        bumped = cls.objects.filter(game=game).update(
+            version=models.F('version') + 1, updated=timezone.now()
+        )
+        if not bumped:
+            cls.objects.create(game=game, version=1)
+
+    @classmethod
+    def of(cls, game):
+        """Returns game's DataVersion, which is version 0 (and has no updated
+        time) if its times have never changed."""
+        try:
+            return cls.objects.get(game=game)
+        except cls.DoesNotExist:
+            return cls(game=game, version=0, updated=None)
+
+    @classmethod
+    def total(cls):
+        """The sum of every game's version, which changes when any does."""
+        return cls.objects.aggregate(total=models.Sum('version')
+                                     )['total'] or 0
+
+    def __str__(self):
+        return '{} version {}'.format(self.game, self.version)
+
+
+class PredictionRun(models.Model):
+    """One fit of the predictor.
+
+    All Prediction* rows belong to a run. A fit writes into a new run, which
+    only becomes the current one when it is marked finished, so readers
+    never see a partially written model.
+    """
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True, default=None)
+    # The first date fitted, or None if the run fitted every date
+    since = models.DateField(null=True, blank=True, default=None)
+
+    @classmethod
+    def finished_runs(cls):
+        """Returns a QuerySet of finished runs, newest first."""
+        return cls.objects.filter(finished__isnull=False
+                                  ).order_by('-finished', '-pk')
+
+    @classmethod
+    def current(cls):
+        """Returns the current run, or None if there isn't one."""
+        return cls.finished_runs().first()
+
+    def __str__(self):
+        return 'Run {} ({})'.format(
+            self.pk, self.finished or 'started {}'.format(self.started)
+        )
+
+
+class PredictionJob(models.Model):
+    """A request to fit the predictor, run by the predictor_worker command."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+        (FAILED, 'Failed'),
+    )
+
+    state = models.CharField(max_length=10, choices=STATES, default=QUEUED)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True, default=None)
+    finished = models.DateTimeField(null=True, blank=True, default=None)
+
+    # Only fit the dates from since on, starting from the current run
+    since = models.DateField(null=True, blank=True, default=None)
+    warm = models.BooleanField(default=False)
+
+    run = models.ForeignKey(
+        PredictionRun,
+        null=True,
+        blank=True,
+        default=None,
+        on_delete=models.SET_NULL
+    )
+    error = models.TextField(blank=True, default='')
+
+    @classmethod
+    def pending(cls):
+        return cls.objects.filter(state__in=[cls.QUEUED, cls.RUNNING])
+
+    @classmethod
+    def latest(cls):
+        return cls.objects.order_by('-created', '-pk').first()
+
+    @classmethod
+    def enqueue(cls, since=None, warm=False):
+        """Queue a job, unless one is already queued.
+
+        Returns the queued job.
+        """
+        with transaction.atomic():
+            job = cls.objects.filter(state=cls.QUEUED).first()
+            if job is None:
+                job = cls.objects.create(since=since, warm=warm)
+            return job
+
+    @classmethod
+    def claim(cls):
+        """Mark the oldest queued job as running and return it.
+
+        Returns None if there are no queued jobs. Only one worker can claim
+        a given job.
+        """
+        while True:
+            job = cls.objects.filter(state=cls.QUEUED
+                                     ).order_by('created', 'pk').first()
+            if job is None:
+                return None
+
+            now = timezone.now()
+            claimed = cls.objects.filter(
+                pk=job.pk, state=cls.QUEUED
+            ).update(state=cls.RUNNING, started=now)
+            if claimed:
+                job.state, job.started = cls.RUNNING, now
+                return job
+
+    @classmethod
+    def fail_stale(cls, timeout):
+        """Mark jobs that have been running longer than timeout as failed.
+
+        Such jobs were abandoned by a worker that died.
+        """
+        return cls.objects.filter(
+            state=cls.RUNNING, started__lt=timezone.now() - timeout
+        ).update(
+            state=cls.FAILED,
+            finished=timezone.now(),
+            error='Abandoned by its worker'
+        )
+
+    def finish(self, run=None, error=''):
+        """Record how the job ended, unless it isn't running anymore.
+
+        A job that fail_stale gave up on stays failed, even if its worker
+        finishes it later. Returns whether the job was updated.
+        """
+        fields = {
+            'state': self.FAILED if error else self.FINISHED,
+            'finished': timezone.now(),
+            'run': run,
+            'error': error,
+        }
+        updated = type(self).objects.filter(
+            pk=self.pk, state=self.RUNNING
+        ).update(**fields)
+        if updated:
+            for name, value in fields.items():
+                setattr(self, name, value)
+        else:
+            self.refresh_from_db()
+        return bool(updated)
+
+    @property
+    def duration(self):
+        """How long the job has been running, or ran for."""
+        if self.started is None:
+            return None
+        return (self.finished or timezone.now()) - self.started
+
+    def __str__(self):
+        return 'Job {} ({})'.format(self.pk, self.state)
+
+
+class PredictionRunData(models.Model):
+    class Meta:
+        abstract = True
+
+    run = models.ForeignKey(PredictionRun, on_delete=models.CASCADE)
+
+    @classmethod
+    def current(cls):
+        """Returns a QuerySet of the rows in the current run."""
+        current_run = PredictionRun.finished_runs().values('pk')[:1]
+        return cls.objects.filter(run=models.Subquery(current_run))
+
+
+class Prediction(PredictionRunData):
+    class Meta:
+        unique_together = (('run', 'time'), )
+
+    time = models.ForeignKey(MiniCrosswordTime, on_delete=models.CASCADE)
     prediction = models.FloatField()
     residual = models.FloatField()
 
 
-class PredictionUser(models.Model):
-    user = models.OneToOneField(CBUser, on_delete=models.CASCADE)
+class PredictionUser(PredictionRunData):
+    class Meta:
+        unique_together = (('run', 'user'), )
+
+    user = models.ForeignKey(CBUser, on_delete=models.CASCADE)
     skill = models.FloatField()
     skill_25 = models.FloatField()
     skill_75 = models.FloatField()
 
+    # In a run that only fitted dates from its since on, the prior on skill,
+    # fitted on the times before since
+    prior_skill = models.FloatField(null=True, blank=True, default=None)
+    prior_skill_sd = models.FloatField(null=True, blank=True, default=None)
 
-class PredictionDate(models.Model):
+
+class PredictionDate(PredictionRunData):
     date = models.DateField()
     difficulty = models.FloatField()
     difficulty_25 = models.FloatField()
     difficulty_75 = models.FloatField()
 
 
-class PredictionParameter(models.Model):
+class PredictionParameter(PredictionRunData):
     time = models.FloatField()
     time_25 = models.FloatField()
     time_75 = models.FloatField()
@@ -807,3 +1379,56 @@ class ItemOwnershipRecord(models.Model):
 
     def __str__(self):
         return '%s: %s %s(s)' % (self.owner, self.quantity, self.item)
+
+
+class SlackOutboxMessage(models.Model):
+    """A message or reaction waiting to be sent to Slack.
+
+    Messages with the same key (a channel, or a response url) are sent in
+    the order they were queued. See crossbot.slack.outbox.
+    """
+    POST = 'post'
+    REACT = 'react'
+    RESPONSE = 'response'
+    KINDS = (
+        (POST, 'Post message'),
+        (REACT, 'Add reaction'),
+        (RESPONSE, 'Post response'),
+    )
+
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    class Meta:
+        index_together = (('state', 'key'), )
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    key = models.CharField(max_length=255)
+    payload = models.TextField()
+
+    # A reaction is added to the message posted by its parent
+    parent = models.ForeignKey(
+        'self', null=True, blank=True, default=None, on_delete=models.CASCADE
+    )
+    ts = models.CharField(max_length=40, null=True, blank=True, default=None)
+
+    state = models.CharField(max_length=10, choices=STATES, default=PENDING)
+    created = models.DateTimeField(auto_now_add=True)
+    claimed = models.DateTimeField(null=True, blank=True, default=None)
+    sent = models.DateTimeField(null=True, blank=True, default=None)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return '{} {} to {} ({})'.format(
+            self.get_kind_display(), self.pk, self.key, self.state
+        )
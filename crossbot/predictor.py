@@ -1,30 +1,48 @@
 """Stan-based statistical model for user skill"""
 
-import pickle
-import pystan
+from django.db.models import Q
 from django.utils import timezone
-from datetime import datetime
+from datetime import datetime, timedelta
 import bisect
 import os
-from hashlib import md5
+from collections import defaultdict, namedtuple
+from operator import attrgetter
 import json
 
-from . import models
+from . import columnar, models, stan_cache
+from .settings import (
+    PREDICTOR_ITER, PREDICTOR_WARM_ITER, PREDICTOR_CHAINS, PREDICTOR_KEEP_RUNS,
+    PREDICTOR_CORES, PREDICTOR_CHAINS_PER_CORE
+)
+from .util import LazyModule
 
-# NOTE 2018-11-21 Tried using a centered parametrization and it didn't work
+np = LazyModule('numpy')
 
+# NOTE 2018-11-21 Tried using a centered parametrization and it didn't work
 
-def index(l):
-    x = list(sorted(set(l), key=id))
-    return [x.index(i) + 1 for i in l]
 
+def index(values, key=None):
+    """Encodes values as 1-based integer codes, ordered by key.
 
-def unindex(l, i):
-    return list(sorted(set(l), key=id))[i - 1]
+    Returns:
+        A 2-tuple (codes, levels), where levels[code - 1] is the value that
+        code stands for.
+    """
+    keys = values if key is None else [key(v) for v in values]
+    if not keys:
+        return [], []
+    unique_keys, codes = np.unique(np.array(keys), return_inverse=True)
+    first = {}
+    for k, v in zip(keys, values):
+        first.setdefault(k, v)
+    return (codes + 1).tolist(), [first[k] for k in unique_keys.tolist()]
 
 
 def data():
-    return models.MiniCrosswordTime.all_times()
+    return (
+        models.MiniCrosswordTime.all_times().select_related('user')
+        .order_by('date', 'user')
+    )
 
 
 def data_json(file):
@@ -44,34 +62,197 @@ def data_json(file):
             yield t
 
 
+def data_columnar(file):
+    """Reads times saved by the export_times command (or downloaded with
+    ?format=columnar), without saving them.
+
+    The encoding has no timestamps, so the play counts (nth) of these times
+    are ordered by date alone.
+    """
+    for user, date, seconds in columnar.rows(columnar.load(file)):
+        yield models.MiniCrosswordTime(
+            user=models.CBUser(user),
+            seconds=seconds,
+            date=date,
+            timestamp=None,
+            deleted=None,
+        )
+
+
 def nth(uids, dates, ts):
-    uid_dates = {
-        the_uid: sorted([t for uid, t in zip(uids, ts) if uid == the_uid])
-        for the_uid in set(uids)
+    uid_ts = defaultdict(list)
+    for uid, t in zip(uids, ts):
+        uid_ts[uid].append(t)
+    for user_ts in uid_ts.values():
+        user_ts.sort()
+    return [bisect.bisect(uid_ts[uid], t) + 1 for uid, t in zip(uids, ts)]
+
+
+# The encoded form of the data, shared by fit and extract_model so the
+# codes only have to be computed once. dates and users map codes (minus one)
+# back to the PredictionDate dates and CBUsers. as_of is when the data was
+# read, and since is the first date fitted (None when fitting everything).
+Encoding = namedtuple(
+    'Encoding', ['times', 'stan_data', 'dates', 'users', 'as_of', 'since']
+)
+
+# Prior scale for skills carried over from an earlier fit, per unit of
+# interquartile range. For a normal distribution the IQR is ~1.349 sigma.
+IQR_PER_SD = 1.349
+
+
+def prior_sd(skill_25, skill_75):
+    """The sd of a normal prior with the interquartile range of a skill."""
+    return max((skill_25 + skill_75) / IQR_PER_SD, 1e-3)
+
+
+def skill_priors(users, priors):
+    """Stan data holding priors[user.pk] = (mu, sd) as fixed skill priors."""
+    params = last_run()
+
+    has_prior, mus, sds = [], [], []
+    for user in users:
+        prior = priors.get(user.pk)
+        has_prior.append(1 if prior else 0)
+        mus.append(prior[0] if prior else 0.0)
+        sds.append(prior[1] if prior else 1.0)
+
+    return {
+        'has_prior': has_prior,
+        'skill_prior_mu': mus,
+        'skill_prior_sd': sds,
+        'skill_dev_prior': params.skill_dev if params and priors else 0.0,
     }
-    return [
-        bisect.bisect(uid_dates[uid], ts) + 1
-        for uid, date, ts in zip(uids, dates, ts)
-    ]
 
 
-def munge_data(data):
+def saved_priors(since):
+    """The skill priors the current run was fitted with, if it also fitted
+    the dates from since on. Otherwise None.
+
+    Those priors only saw the times before since, so unlike the current
+    skills, they can be used again without counting the window twice.
+    """
+    run = models.PredictionRun.current()
+    if run is None or run.since != since:
+        return None
+    rows = models.PredictionUser.current().filter(
+        prior_skill__isnull=False
+    ).values_list('user_id', 'prior_skill', 'prior_skill_sd')
+    return {user_id: (mu, sd) for user_id, mu, sd in rows}
+
+
+def fit_priors(since, quiet=True):
+    """Fit the times before since, and return the skill posteriors as
+    priors[user_id] = (mu, sd)."""
+    encoding = encode(data().filter(date__lt=since))
+    if not encoding.times:
+        return {}
+    skills = fit(encoding, quiet=quiet).extract(pars=['skill_effect'])
+    return {
+        user.pk: (mean, prior_sd(lo, hi))
+        for user, mean, lo, hi in zip(
+            encoding.users,
+            *(a.tolist() for a in summarize(skills['skill_effect']))
+        )
+    }
+
+
+def encode(data, since=None, priors=None):
+    """Encode data for Stan.
+
+    If since is given, only times on or after since are fitted, and priors
+    (see fit_priors) are used as the skills of users seen before. Play
+    counts (nth) still count the whole history.
+    """
+    if isinstance(data, Encoding):
+        return data
+
+    as_of = timezone.now()
     data = list(data)  # Collapse any streams
-    uids = [t.user for t in data]
+    ts = [t.timestamp or t.date for t in data]
+    nths = nth([t.user.pk for t in data], None, ts)
+
+    if since is not None:
+        window = [i for i, t in enumerate(data) if t.date >= since]
+        data = [data[i] for i in window]
+        nths = [nths[i] for i in window]
+
+    users = [t.user for t in data]
     dates = [t.date for t in data]
-    dows = [(t.date.weekday() + 1) % 7 + 1 for t in data]
     secs = [t.seconds for t in data]
-    ts = [t.timestamp or t.date for t in data]
-    return {
-        'uids': index(uids),
-        'dates': index(dates),
-        'nth': nth(uids, dates, ts),
-        'dows': dows,
+
+    uid_codes, user_levels = index(users, key=attrgetter('pk'))
+    date_codes, date_levels = index(dates)
+
+    stan_data = {
+        'uids': uid_codes,
+        'dates': date_codes,
+        'nth': nths,
+        'dows': [(d.weekday() + 1) % 7 + 1 for d in dates],
         'secs': secs,
-        'Us': len(set(uids)),
+        'Us': len(user_levels),
         'Ss': len(secs),
-        'Ds': len(set(dates)),
+        'Ds': len(date_levels),
+        'Ns': max([len(date_levels)] + nths),
     }
+    if since is not None:
+        stan_data.update(skill_priors(user_levels, priors or {}))
+    else:
+        stan_data.update({
+            'has_prior': [0] * len(user_levels),
+            'skill_prior_mu': [0.0] * len(user_levels),
+            'skill_prior_sd': [1.0] * len(user_levels),
+            'skill_dev_prior': 0.0,
+        })
+
+    return Encoding(data, stan_data, date_levels, user_levels, as_of, since)
+
+
+def last_run():
+    """Returns the PredictionParameter of the current run, or None."""
+    return models.PredictionParameter.current().first()
+
+
+def changed_since(when):
+    """Whether any times were added or deleted after when."""
+    return models.MiniCrosswordTime.objects.filter(
+        Q(timestamp__gt=when) | Q(deleted__gt=when)
+    ).exists()
+
+
+def warm_start(data, chains):
+    """Initial values for each chain, taken from the saved posterior means.
+
+    Returns 'random' (Stan's default) if there is no saved fit.
+    """
+    params = last_run()
+    if params is None:
+        return 'random'
+
+    encoding = encode(data)
+    skills = dict(
+        models.PredictionUser.current().values_list('user_id', 'skill')
+    )
+    difficulties = dict(
+        models.PredictionDate.current().values_list('date', 'difficulty')
+    )
+
+    init = {
+        'mu': params.time,
+        'sigma': params.sigma,
+        'skill_effect': [skills.get(u.pk, 0.0) for u in encoding.users],
+        'skill_dev': params.skill_dev,
+        'date_effect': [difficulties.get(d, 0.0) for d in encoding.dates],
+        'date_dev': params.date_dev,
+        'sat_effect': params.satmult,
+        'beginner_gain': params.bgain,
+        'beginner_decay': params.bdecay,
+    }
+    return [init] * chains
+
+
+def munge_data(data):
+    return encode(data).stan_data
 
 
 class suppress_stdout_stderr(object):
@@ -109,140 +290,254 @@ class suppress_stdout_stderr(object):
                 os.close(fd)
 
 
-def fit(data, quiet=False):
+def model_code():
     path = os.path.join(os.path.dirname(__file__), 'predictor.stan')
     with open(path, "r") as f:
-        code = f.read()
-    hash = md5(code.encode("ascii")).hexdigest()
-    try:
-        os.makedirs(os.path.expanduser("~/.cache/crossbot/"))
-    except FileExistsError:
-        pass
+        return f.read()
+
+
+def get_model(force=False):
+    """Get the compiled model, from the cache if possible."""
+    return stan_cache.get_model(model_code(), force=force)
+
+
+def sampling_jobs(chains=PREDICTOR_CHAINS):
+    """How many processes to sample chains in."""
+    cores = PREDICTOR_CORES or os.cpu_count() or 1
+    per_core = max(PREDICTOR_CHAINS_PER_CORE, 1)
+    return max(1, min(cores, -(-chains // per_core)))
+
+
+def fit(data, quiet=False, warm=False):
+    """Sample the model for data.
+
+    If warm is set, the chains start from the saved fit's posterior means
+    and run for fewer iterations.
+    """
+    sm = get_model()
+    with suppress_stdout_stderr(quiet=quiet):
+        return sm.sampling(
+            data=encode(data).stan_data,
+            iter=PREDICTOR_WARM_ITER if warm else PREDICTOR_ITER,
+            chains=PREDICTOR_CHAINS,
+            init=(warm_start(data, PREDICTOR_CHAINS) if warm else 'random'),
+            n_jobs=sampling_jobs(),
+            pars=[
+                'date_effect', 'skill_effect', 'predictions', 'residuals',
+                'beginner_gain', 'beginner_decay', 'sat_effect', 'mu',
+                'skill_dev', 'date_dev', 'sigma'
+            ],
+        )
 
-    cache_path = os.path.expanduser(
-        '~/.cache/crossbot/predictor.' + hash + '.model'
-    )
-    if os.path.exists(cache_path):
-        with open(cache_path, "rb") as f:
-            sm = pickle.load(f)
-    else:
-        print("Compiling model, please wait")
-        sm = pystan.StanModel(model_code=code)
-        with open(cache_path, "wb") as f:
-            pickle.dump(sm, f)
 
-    try:
-        with suppress_stdout_stderr(quiet=quiet):
-            fm = sm.sampling(
-                data=munge_data(data),
-                iter=1000,
-                chains=4,
-                n_jobs=2,
-                pars=[
-                    'date_effect', 'skill_effect', 'predictions', 'residuals',
-                    'beginner_gain', 'beginner_decay', 'sat_effect', 'mu',
-                    'skill_dev', 'date_dev', 'sigma'
-                ],
-            )
-    except:
-        if os.path.exists(cache_path):
-            os.remove(cache_path)
-        raise
-    return fm
+def summarize(draws):
+    """Summarize the posterior of each column of draws.
 
+    Returns arrays of the means, and of the distances from each mean to the
+    25th and 75th percentiles.
+    """
+    mean = draws.mean(axis=0)
+    q25, q75 = np.percentile(draws, [25, 75], axis=0)
+    return mean, mean - q25, q75 - mean
 
-def drange(data):
-    data.sort()
-    mu = data.mean()
-    return mu, mu - data[len(data) // 4], data[len(data) * 3 // 4] - mu
+
+# Model parameters summarized into PredictionParameter fields
+QUARTILE_PARAMS = {
+    'time': 'mu',
+    'satmult': 'sat_effect',
+    'bgain': 'beginner_gain',
+    'bdecay': 'beginner_decay',
+}
+MEAN_PARAMS = {
+    'skill_dev': 'skill_dev',
+    'date_dev': 'date_dev',
+    'sigma': 'sigma',
+    'lp': 'lp__',
+}
 
 
 def extract_model(data, fm):
-    params = fm.extract()
-
-    dates = []
-    for i, multiplier in enumerate(params["date_effect"].transpose()):
-        date = unindex([t.date for t in data], i + 1)
-        mult_mean, mult_25, mult_75 = drange(multiplier)
-        dates.append(
-            models.PredictionDate(
-                date=date,
-                difficulty=mult_mean,
-                difficulty_25=mult_25,
-                difficulty_75=mult_75
-            )
-        )
+    encoding = encode(data)
 
-    users = []
-    for i, multiplier in enumerate(params["skill_effect"].transpose()):
-        uid = unindex([t.user for t in data], i + 1)
-        mult_mean, mult_25, mult_75 = drange(multiplier)
-        users.append(
-            models.PredictionUser(
-                user=uid,
-                skill=mult_mean,
-                skill_25=mult_25,
-                skill_75=mult_75,
-            )
-        )
+    # Extract one parameter at a time, so only one parameter's draws are in
+    # memory at once. The predictions and residuals are the big ones.
+    def draws(par):
+        return fm.extract(pars=[par])[par]
 
-    recs = []
-    for t, prediction, residual in zip(data, params["predictions"].transpose(),
-                                       params["residuals"].transpose()):
-        recs.append(
-            models.Prediction(
-                time=t, prediction=prediction.mean(), residual=residual.mean()
-            )
+    def summaries(par):
+        return zip(*(a.tolist() for a in summarize(draws(par))))
+
+    def means(par):
+        return draws(par).mean(axis=0).tolist()
+
+    dates = [
+        models.PredictionDate(
+            date=date, difficulty=mean, difficulty_25=lo, difficulty_75=hi
+        ) for date, (mean, lo, hi) in zip(
+            encoding.dates, summaries('date_effect')
+        )
+    ]
+    users = [
+        models.PredictionUser(user=user, skill=mean, skill_25=lo, skill_75=hi)
+        for user, (mean, lo, hi) in zip(
+            encoding.users, summaries('skill_effect')
+        )
+    ]
+    recs = [
+        models.Prediction(time=t, prediction=prediction, residual=residual)
+        for t, prediction, residual in zip(
+            encoding.times, means('predictions'), means('residuals')
         )
+    ]
+
+    fields = {}
+    for field, par in QUARTILE_PARAMS.items():
+        mean, lo, hi = summarize(draws(par))
+        fields.update({
+            field: float(mean),
+            field + '_25': float(lo),
+            field + '_75': float(hi)
+        })
+    for field, par in MEAN_PARAMS.items():
+        fields[field] = float(draws(par).mean())
+    params = models.PredictionParameter(when_run=encoding.as_of, **fields)
 
-    bgain_mean, bgain_25, bgain_75 = drange(params['beginner_gain'])
-    bdecay_mean, bdecay_25, bdecay_75 = drange(params['beginner_decay'])
-    time_mean, time_25, time_75 = drange(params['mu'])
-    satmult_mean, satmult_25, satmult_75 = drange(params['sat_effect'])
-    params = models.PredictionParameter(
-        time=time_mean,
-        time_25=time_25,
-        time_75=time_75,
-        satmult=satmult_mean,
-        satmult_25=satmult_25,
-        satmult_75=satmult_75,
-        bgain=bgain_mean,
-        bgain_25=bgain_25,
-        bgain_75=bgain_75,
-        bdecay=bdecay_mean,
-        bdecay_25=bdecay_25,
-        bdecay_75=bdecay_75,
-        skill_dev=params['skill_dev'].mean(),
-        date_dev=params['date_dev'].mean(),
-        sigma=params['sigma'].mean(),
-        lp=params["lp__"].mean(),
-        when_run=timezone.now(),
-    )
     return recs, dates, users, params
 
 
-def save(model):
+# Rows per INSERT statement when saving a model. SQLite limits the number
+# of variables per statement, and Prediction has 4 columns.
+SAVE_BATCH_SIZE = 200
+
+
+def insert(objs, key):
+    """Bulk insert objs, which all belong to the same run.
+
+    Afterwards every object in objs has the pk of its row. key is a field
+    name that is unique within a run.
+    """
+    if not objs:
+        return
+    model = type(objs[0])
+    model.objects.bulk_create(objs, batch_size=SAVE_BATCH_SIZE)
+
+    # SQLite doesn't return the ids of bulk inserted rows, so look them up
+    if objs[0].pk is None:
+        pks = dict(
+            model.objects.filter(run=objs[0].run).values_list(key, 'pk')
+        )
+        for obj in objs:
+            obj.pk = pks[getattr(obj, key)]
+
+
+def carry_over(queryset, run):
+    """Copies of the rows in queryset, moved to run."""
+    rows = list(queryset)
+    for row in rows:
+        row.pk = None
+        row.run = run
+    return rows
+
+
+def save(model, since=None, priors=None):
+    """Save model as a new run, and make it the current one.
+
+    If since is given, the model only covers dates from since on, so the
+    current run's predictions for earlier dates and skills of users not in
+    the model are carried over into the new run. The priors the model was
+    fitted with are saved too, so the next fit from since can reuse them.
+    """
     recs, dates, users, params = model
-    models.Prediction.objects.all().delete()
-    models.PredictionUser.objects.all().delete()
-    models.PredictionDate.objects.all().delete()
-    models.PredictionParameter.objects.all().delete()
-
-    for rec in recs:
-        rec.save()
-    for date in dates:
-        date.save()
+    run = models.PredictionRun.objects.create(since=since)
+
+    recs, dates, users = list(recs), list(dates), list(users)
+    if since is not None:
+        user_ids = [u.user_id for u in users]
+        recs += carry_over(
+            models.Prediction.current().filter(time__date__lt=since), run
+        )
+        dates += carry_over(
+            models.PredictionDate.current().filter(date__lt=since), run
+        )
+        users += carry_over(
+            models.PredictionUser.current().exclude(user__in=user_ids), run
+        )
+
+    priors = priors if since is not None else None
     for user in users:
-        user.user.save()
-        user.save()
+        user.prior_skill, user.prior_skill_sd = (priors or {}).get(
+            user.user_id, (None, None)
+        )
+
+    for obj in recs + dates + users + [params]:
+        obj.run = run
+
+    insert(recs, 'time_id')
+    insert(dates, 'date')
+    insert(users, 'user_id')
     params.save()
 
+    # Flip the current run pointer
+    run.finished = timezone.now()
+    run.save()
+
+    collect_runs()
+    return run
 
-def load():
-    recs = list(models.Prediction.objects.all())
-    dates = list(models.PredictionDate.objects.all())
-    user = list(models.PredictionUser.objects.all())
-    params = models.PredictionParameter.objects.all()[:1].get()
+
+def run_job(job, quiet=True):
+    """Fit and save the model for a claimed PredictionJob."""
+    try:
+        priors = None
+        if job.since is not None:
+            priors = saved_priors(job.since)
+            if priors is None:
+                priors = fit_priors(job.since, quiet=quiet)
+        encoding = encode(data(), since=job.since, priors=priors)
+        model = extract_model(
+            encoding, fit(encoding, quiet=quiet, warm=job.warm)
+        )
+        run = save(model, since=job.since, priors=priors)
+    except Exception as e:
+        job.finish(error=repr(e))
+        raise
+    job.finish(run=run)
+    return run
+
+
+def collect_runs(keep=None):
+    """Delete all but the newest keep finished runs.
+
+    Also deletes unfinished runs that were abandoned over a day ago.
+    """
+    if keep is None:
+        keep = PREDICTOR_KEEP_RUNS
+    keep = max(keep, 1)
+
+    old_runs = models.PredictionRun.finished_runs().values_list(
+        'pk', flat=True
+    )[keep:]
+    models.PredictionRun.objects.filter(pk__in=list(old_runs)).delete()
+    models.PredictionRun.objects.filter(
+        finished=None, started__lt=timezone.now() - timedelta(days=1)
+    ).delete()
+
+
+def load(run=None):
+    """Load the model saved in run, by default the current one."""
+    if run is None:
+        run = models.PredictionRun.current()
+    recs = list(
+        models.Prediction.objects.filter(run=run)
+        .order_by('time__date', 'time__user')
+    )
+    dates = list(
+        models.PredictionDate.objects.filter(run=run).order_by('date')
+    )
+    user = list(
+        models.PredictionUser.objects.filter(run=run).order_by('user')
+    )
+    params = models.PredictionParameter.objects.get(run=run)
     return recs, dates, user, params
 
 
@@ -250,8 +545,12 @@ def load():
 
 import math
 from datetime import datetime
-import matplotlib, matplotlib.dates, matplotlib.figure, matplotlib.ticker
-import matplotlib.backends.backend_agg as agg
+
+matplotlib = LazyModule(
+    'matplotlib', 'matplotlib.dates', 'matplotlib.figure',
+    'matplotlib.gridspec', 'matplotlib.ticker'
+)
+agg = LazyModule('matplotlib.backends.backend_agg')
 
 
 def plot_dates(model):
@@ -400,7 +699,10 @@ def selsubs(data, model):
 
 if __name__ == "__main__":
     import sys
-    DATA = data_json(sys.argv[1])
+    if sys.argv[1].endswith('.json'):
+        DATA = encode(data_json(sys.argv[1]))
+    else:
+        DATA = encode(data_columnar(sys.argv[1]))
     FIT = fit(DATA)
     MODEL = extract_model(DATA, FIT)
     save(MODEL)
@@ -4,3 +4,65 @@ from django.conf import settings as s
 CROSSBUCKS_PER_SOLVE = getattr(s, 'CROSSBOT_CROSSBUCKS_PER_SOLVE', 10)
 ITEM_DROP_RATE = getattr(s, 'CROSSBOT_ITEM_DROP_RATE', 0.1)
 DEFAULT_TITLE = getattr(s, 'CROSSBOT_DEFAULT_TITLE', "Crossworder")
+
+# Each process caches up to USER_CACHE_SIZE user names for USER_CACHE_TTL
+# seconds.
+USER_CACHE_SIZE = getattr(s, 'CROSSBOT_USER_CACHE_SIZE', 1024)
+USER_CACHE_TTL = getattr(s, 'CROSSBOT_USER_CACHE_TTL', 300)
+
+# Slack API calls time out after SLACK_TIMEOUT seconds, and are retried up to
+# SLACK_RETRIES times. Rate limited calls are only retried if Slack asks us to
+# wait at most SLACK_MAX_RETRY_AFTER seconds.
+SLACK_TIMEOUT = getattr(s, 'CROSSBOT_SLACK_TIMEOUT', 5)
+SLACK_RETRIES = getattr(s, 'CROSSBOT_SLACK_RETRIES', 2)
+SLACK_MAX_RETRY_AFTER = getattr(s, 'CROSSBOT_SLACK_MAX_RETRY_AFTER', 2)
+# How many reactions to a message are added at once
+SLACK_REACTION_THREADS = getattr(s, 'CROSSBOT_SLACK_REACTION_THREADS', 4)
+
+# Each process logs the latency, errors and retries of its Slack calls every
+# SLACK_STATS_LOG_MINS minutes
+SLACK_STATS_LOG_MINS = getattr(s, 'CROSSBOT_SLACK_STATS_LOG_MINS', 60)
+
+# Messages and reactions from slash commands are queued in an outbox, and
+# sent by a background thread unless SLACK_OUTBOX_ASYNC is False. Failed
+# sends are retried with backoff, up to SLACK_OUTBOX_MAX_ATTEMPTS times.
+SLACK_OUTBOX_ASYNC = getattr(s, 'CROSSBOT_SLACK_OUTBOX_ASYNC', True)
+SLACK_OUTBOX_MAX_ATTEMPTS = getattr(s, 'CROSSBOT_SLACK_OUTBOX_MAX_ATTEMPTS', 5)
+
+# /sql and /query run in a pool of SQL_WORKERS sandboxed processes, which are
+# replaced after SQL_WORKER_MAX_QUERIES queries. Queries are interrupted after
+# SQL_TIMEOUT seconds.
+SQL_WORKERS = getattr(s, 'CROSSBOT_SQL_WORKERS', 2)
+SQL_WORKER_MAX_QUERIES = getattr(s, 'CROSSBOT_SQL_WORKER_MAX_QUERIES', 100)
+SQL_TIMEOUT = getattr(s, 'CROSSBOT_SQL_TIMEOUT', 1)
+# Results are cut off at 20 rows, or about this many bytes
+SQL_MAX_BYTES = getattr(s, 'CROSSBOT_SQL_MAX_BYTES', 4096)
+# The queries run against a snapshot of the database, by default next to it,
+# which is retaken when the times change or it's older than
+# SQL_SNAPSHOT_MAX_AGE seconds.
+SQL_SNAPSHOT_PATH = getattr(s, 'CROSSBOT_SQL_SNAPSHOT_PATH', None)
+SQL_SNAPSHOT_MAX_AGE = getattr(s, 'CROSSBOT_SQL_SNAPSHOT_MAX_AGE', 300)
+# Number of saved query results /query keeps cached
+SQL_CACHE_SIZE = getattr(s, 'CROSSBOT_SQL_CACHE_SIZE', 256)
+
+# Predictor settings. When PREDICTOR_WINDOW_DAYS is set, the hourly refit
+# only samples the recent days (between one and two windows' worth), using
+# skills fitted on the earlier days as priors.
+PREDICTOR_ITER = getattr(s, 'CROSSBOT_PREDICTOR_ITER', 1000)
+PREDICTOR_WARM_ITER = getattr(s, 'CROSSBOT_PREDICTOR_WARM_ITER', 300)
+PREDICTOR_CHAINS = getattr(s, 'CROSSBOT_PREDICTOR_CHAINS', 4)
+PREDICTOR_WINDOW_DAYS = getattr(s, 'CROSSBOT_PREDICTOR_WINDOW_DAYS', None)
+PREDICTOR_KEEP_RUNS = getattr(s, 'CROSSBOT_PREDICTOR_KEEP_RUNS', 3)
+
+# The predictor_worker command samples chains in parallel on up to
+# PREDICTOR_CORES cores (default all of them), PREDICTOR_CHAINS_PER_CORE at a
+# time on each.
+PREDICTOR_CORES = getattr(s, 'CROSSBOT_PREDICTOR_CORES', None)
+PREDICTOR_CHAINS_PER_CORE = getattr(s, 'CROSSBOT_PREDICTOR_CHAINS_PER_CORE', 1)
+PREDICTOR_JOB_TIMEOUT_MINS = getattr(
+    s, 'CROSSBOT_PREDICTOR_JOB_TIMEOUT_MINS', 180
+)
+
+PREDICTOR_CACHE_DIR = getattr(
+    s, 'CROSSBOT_PREDICTOR_CACHE_DIR', '~/.cache/crossbot/'
+)
@@ -1,20 +1,139 @@
 """Methods for sending requests directly to Slack."""
 
+import copy
 import json
 import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from django.conf import settings
 
+from crossbot.settings import (
+    SLACK_TIMEOUT, SLACK_RETRIES, SLACK_MAX_RETRY_AFTER, SLACK_STATS_LOG_MINS,
+    SLACK_REACTION_THREADS
+)
+
 logger = logging.getLogger(__name__)
 
 SLACK_URL = 'https://slack.com/api/'
 
+_local = threading.local()
+
+
+def _session():
+    """The current thread's Slack session.
+
+    The session keeps connections to Slack alive between calls, and retries
+    requests that fail to connect.
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        retry = Retry(
+            total=SLACK_RETRIES,
+            connect=SLACK_RETRIES,
+            read=0,
+            status=0,
+            backoff_factor=0.2
+        )
+        session.mount('https://', HTTPAdapter(max_retries=retry))
+        _local.session = session
+    return session
+
+
+class EndpointStats:
+    """Latency of the calls made to one Slack endpoint in this process."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.0
+
+    def __repr__(self):
+        return (
+            '<{} calls, {} errors, {} retries, {:.3f}s mean, {:.3f}s max>'.
+            format(self.calls, self.errors, self.retries, self.mean, self.max)
+        )
+
+
+_stats = defaultdict(EndpointStats)
+_stats_lock = threading.Lock()
+_last_logged = time.monotonic()
+
+
+def _record(endpoint, seconds, ok):
+    global _last_logged
+    with _stats_lock:
+        stats = _stats[endpoint]
+        stats.calls += 1
+        stats.errors += not ok
+        stats.total += seconds
+        stats.max = max(stats.max, seconds)
+
+        now = time.monotonic()
+        log = now - _last_logged >= SLACK_STATS_LOG_MINS * 60
+        if log:
+            _last_logged = now
+    if log:
+        log_api_stats()
+
+
+def _record_retry(endpoint):
+    with _stats_lock:
+        _stats[endpoint].retries += 1
+
+
+def api_stats():
+    """Returns a snapshot of the EndpointStats for each endpoint called."""
+    with _stats_lock:
+        return {name: copy.copy(stats) for name, stats in _stats.items()}
+
+
+def log_api_stats():
+    """Logs the EndpointStats of this process, one line per endpoint.
+
+    _record calls this every SLACK_STATS_LOG_MINS minutes.
+    """
+    for name, stats in sorted(api_stats().items()):
+        logger.info('Slack %s since startup: %r', name, stats)
+
+
+def _retry_after(resp, method, attempt):
+    """How long to wait before retrying resp, or None to not retry."""
+    if attempt >= SLACK_RETRIES:
+        return None
+
+    if resp.status_code == 429:
+        # Slack tells us how long we're rate limited for
+        try:
+            wait = float(resp.headers.get('Retry-After', 1))
+        except ValueError:
+            wait = 1.0
+        return wait if wait <= SLACK_MAX_RETRY_AFTER else None
+
+    if resp.status_code >= 500 and method == 'GET':
+        return 0.2 * 2**attempt
+
+    return None
+
 
 def _slack_api(
         *, endpoint='', method='POST', base_url=None, headers=None, **kwargs
 ):
-    assert method in ['GET', 'POST']
+    if method not in ['GET', 'POST']:
+        raise ValueError('invalid method: ' + method)
 
     headers = headers if headers is not None else {}
     headers['Authorization'] = (
@@ -23,24 +142,56 @@ def _slack_api(
 
     url = base_url if base_url is not None else SLACK_URL
     url += endpoint
+    name = endpoint or 'response_url'
 
-    if method == 'GET':
-        func = requests.get
-    elif method == 'POST':
-        func = requests.post
-    else:
-        raise ValueError('invalid method: ' + method)
+    attempt = 0
+    while True:
+        start = time.monotonic()
+        try:
+            resp = _session().request(
+                method, url, headers=headers, timeout=SLACK_TIMEOUT, **kwargs
+            )
+        except requests.RequestException:
+            _record(name, time.monotonic() - start, False)
+            raise
+        elapsed = time.monotonic() - start
+        _record(name, elapsed, resp.status_code < 400)
+        logger.debug(
+            'Slack %s took %.3fs (%s)', name, elapsed, resp.status_code
+        )
 
-    return func(url, headers=headers, **kwargs)
+        wait = _retry_after(resp, method, attempt)
+        if wait is None:
+            return resp
 
+        logger.warning(
+            'Slack %s returned %s, retrying in %.1fs', name,
+            resp.status_code, wait
+        )
+        _record_retry(name)
+        time.sleep(wait)
+        attempt += 1
 
-def _slack_api_ok(key, **kwargs):
+
+class SlackError(ValueError):
+    """Slack responded to a call with an error."""
+
+    def __init__(self, error):
+        super().__init__('bad response: {}'.format(error))
+        self.error = error
+
+
+def _slack_api_json(**kwargs):
     resp = _slack_api(**kwargs).json()
     if resp.get('ok'):
-        return resp[key]
+        return resp
 
     logger.error('bad response: %s', resp)
-    raise ValueError('bad response: ' + resp.get('error'))
+    raise SlackError(resp.get('error'))
+
+
+def _slack_api_ok(key, **kwargs):
+    return _slack_api_json(**kwargs)[key]
 
 
 def slack_user(user_id):
@@ -49,8 +200,23 @@ def slack_user(user_id):
     )
 
 
+# Slack recommends pages of at most 200 users
+USERS_PAGE_SIZE = 200
+
+
 def slack_users():
-    return _slack_api_ok('members', endpoint='users.list', method='GET')
+    """Yields every user in the workspace, one page at a time."""
+    params = {'limit': USERS_PAGE_SIZE}
+    while True:
+        resp = _slack_api_json(
+            endpoint='users.list', method='GET', params=params
+        )
+        yield from resp['members']
+
+        cursor = resp.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            return
+        params = dict(params, cursor=cursor)
 
 
 def post_message(channel, message_dict):
@@ -74,12 +240,36 @@ def post_response(response_url, message_dict):
 
 
 def react(emoji, channel, timestamp):
-    return _slack_api_ok(
-        'ok',
-        endpoint='reactions.add',
-        params={
-            'name': emoji,
-            'channel': channel,
-            'timestamp': timestamp,
-        }
-    )
+    try:
+        return _slack_api_ok(
+            'ok',
+            endpoint='reactions.add',
+            params={
+                'name': emoji,
+                'channel': channel,
+                'timestamp': timestamp,
+            }
+        )
+    except SlackError as e:
+        # Adding a reaction twice is fine, e.g. when retrying
+        if e.error == 'already_reacted':
+            return True
+        raise
+
+
+_reaction_pool = ThreadPoolExecutor(
+    max_workers=SLACK_REACTION_THREADS, thread_name_prefix='slack-react'
+)
+
+
+def react_all(emojis, channel, timestamp):
+    """Add several reactions to a message at once.
+
+    Returns a dict from each emoji to the exception raised adding it, or None
+    if it was added. One failed reaction doesn't stop the others.
+    """
+    futures = {
+        emoji: _reaction_pool.submit(react, emoji, channel, timestamp)
+        for emoji in emojis
+    }
+    return {emoji: future.exception() for emoji, future in futures.items()}
@@ -1,25 +1,31 @@
 import logging
 import datetime
-import statistics
 
 from collections import defaultdict
 from itertools import cycle, groupby, count
 
-import numpy as np
-
-# don't use matplotlib gui
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-
 from . import parse_date, date_fmt, models, SlashCommandResponse
+from ... import stats
+from ...util import LazyModule
 
 from settings import MEDIA_URL, MEDIA_ROOT
 
 logger = logging.getLogger(__name__)
 
 
+def _use_agg():
+    # don't use matplotlib gui
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# These take most of a second to import, so only do it when plotting
+np = LazyModule('numpy')
+matplotlib = LazyModule('matplotlib', 'matplotlib.ticker')
+plt = LazyModule('matplotlib.pyplot', setup=_use_agg)
+mdates = LazyModule('matplotlib.dates')
+
+
 def init(parser):
     parser = parser.subparsers.add_parser('plot', help='plot something')
     parser.set_defaults(
@@ -147,15 +153,6 @@ def date_dt(date):
     return datetime.datetime.strptime(date, date_fmt).date()
 
 
-def username_from_slackid(slackid):
-    user = models.CBUser.from_slackid(slackid)
-    if user:
-        return str(user)
-    else:
-        logger.debug("Can't find slack name for %s", slackid)
-    return slackid
-
-
 def plot(request):
     '''Plot everyone's times in a date range.
     `smoothing` is between 0 (no smoothing) and 1 exclusive. .6 default
@@ -210,7 +207,9 @@ def plot(request):
     # back. Normalized uses smoothing, so we don't want the initial point
     # plotted to be "overweighted" because there's no history
     if args.score_function is get_normalized_scores:
-        start_dt -= datetime.timedelta(days=int(1 / (1 - args.smooth)))
+        start_dt -= datetime.timedelta(
+            days=stats.smoothing_days(args.smooth)
+        )
         start_date = start_dt.strftime(date_fmt)
 
     entries = (
@@ -345,59 +344,9 @@ def plot(request):
 def get_normalized_scores(entries, args):
     """Generate smoothed scores based on mean, stdev of that days times. """
 
-    times_by_date = defaultdict(dict)
-    for e in entries:
-        x = e.seconds
-        # if x > 0:
-        #     x = np.log(x)
-        times_by_date[e.date][e.user] = x
-
-    sorted_dates = sorted(times_by_date.keys())
-
-    # failures come with a heaver ranking penalty
-    MAX_SCORE = 1.5
-    FAILURE_PENALTY = -2
-
-    def mk_score(mean, t, stdev):
-        if t < 0:
-            return FAILURE_PENALTY
-        if stdev == 0:
-            return 0
-
-        score = (mean - t) / stdev
-        return np.clip(score, -MAX_SCORE, MAX_SCORE)
-
-    # scores are the stdev away from mean of that day
-    scores = {}
-    for date, user_times in times_by_date.items():
-        times = [t for t in user_times.values() if t is not None]
-        # make failures 1 minute worse than the worst time
-        times = [t if t >= 0 else max(times) + 60 for t in times]
-        q1, q3 = np.percentile(times, [25, 75])
-        stdev = statistics.pstdev(times)
-        o1, o3 = q1 - stdev, q3 + stdev
-        times = [t for t in times if o1 <= t <= o3]
-        mean = statistics.mean(times)
-        stdev = statistics.pstdev(times, mean)
-        scores[date] = {
-            userid: mk_score(mean, t, stdev)
-            for userid, t in user_times.items()
-            if t is not None
-        }
-
-    new_score_weight = 1 - args.smooth
-    running = defaultdict(list)
-
-    weighted_scores = defaultdict(dict)
-    for date in sorted_dates:
-        for user, score in scores[date].items():
-
-            old_score = running.get(user)
-
-            new_score = score * new_score_weight + old_score * (1 - new_score_weight) \
-                        if old_score is not None else score
-
-            weighted_scores[user][date] = running[user] = new_score
+    weighted_scores = stats.normalized_scores(
+        ((e.date, e.user, e.seconds) for e in entries), args.smooth
+    )
 
     ticker = matplotlib.ticker.MultipleLocator(base=0.25)
     formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
@@ -423,17 +372,11 @@ def get_times(entries, args):
 
 
 def get_win_streaks(entries, args):
-    """Just get the times, keeping failures because we're just going for completion"""
-
-    best_time = defaultdict(lambda: 99999999999999)
-    for e in entries:
-        if e.seconds >= 0:
-            best_time[e.date] = min(best_time[e.date], e.seconds)
+    """Just get the winning times, looked up from the daily results."""
 
     times = defaultdict(dict)
-    for e in entries:
-        if e.seconds == best_time[e.date]:
-            times[e.user][e.date] = e.seconds
+    for e in args.table.winning_entries(entries):
+        times[e.user][e.date] = e.seconds
 
     ticker = None
     formatter = None
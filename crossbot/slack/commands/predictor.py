@@ -15,7 +15,8 @@ def init(parser):
     parser.add_argument(
         'cmd',
         default='performance',
-        help="What information to print about the predictor",
+        help="What information to print about the predictor "
+        "(performance, details, validate or runs)",
         nargs='?'
     )
 
@@ -27,6 +28,8 @@ def predictor(request):
         return SlashCommandResponse(text=details())
     elif request.args.cmd == 'validate':
         return SlashCommandResponse(text=validate())
+    elif request.args.cmd == 'runs':
+        return SlashCommandResponse(text=runs())
     else:
         return SlashCommandResponse(
             text="Error: no known predictor command `{}`"
@@ -36,8 +39,8 @@ def predictor(request):
 
 def performance():
     date = parse_date('now')
-    predictions = models.Prediction.objects.filter(time__date=date
-                                                   ).order_by('residual')
+    predictions = models.Prediction.current().filter(time__date=date
+                                                    ).order_by('residual')
     return "".join([
         "{}: {:0.2f}\n".format(p.time.user.slackname, p.residual)
         for p in predictions
@@ -45,17 +48,49 @@ def performance():
 
 
 def details():
-    params = models.PredictionParameter.objects.order_by('when_run')[:1].get()
-    return "*Last model run*: {:%Y-%m-%d %H:%M}\n*log(P)* = {}".format(
-        timezone.localtime(params.when_run), params.lp
-    )
+    msgs = []
+
+    params = models.PredictionParameter.current().first()
+    if params:
+        msgs.append(
+            "*Last model run*: {:%Y-%m-%d %H:%M}\n*log(P)* = {}".format(
+                timezone.localtime(params.when_run), params.lp
+            )
+        )
+
+    job = models.PredictionJob.latest()
+    if job:
+        msgs.append(job_status(job))
+
+    return "\n".join(msgs) or "The predictor has never run"
+
+
+def job_status(job):
+    Job = models.PredictionJob
+    if job.state == Job.QUEUED:
+        status = "queued at {:%Y-%m-%d %H:%M}".format(
+            timezone.localtime(job.created)
+        )
+    elif job.state == Job.RUNNING:
+        status = "running for {}".format(format_duration(job.duration))
+    else:
+        status = "{} at {:%Y-%m-%d %H:%M} after {}".format(
+            job.state, timezone.localtime(job.finished),
+            format_duration(job.duration)
+        )
+    return "*Latest job*: {}".format(status)
+
+
+def format_duration(duration):
+    minutes, seconds = divmod(int(duration.total_seconds()), 60)
+    return "{}m {:02}s".format(minutes, seconds)
 
 
 def validate():
     lsecs = []
     psecs = []
 
-    for i, p in enumerate(models.Prediction.objects.all()):
+    for i, p in enumerate(models.Prediction.current().select_related('time')):
         secs = p.time.seconds
         lsecs.append(math.log(secs if 0 < secs < 300 else 300))
         psecs.append(p.prediction)
@@ -66,3 +101,16 @@ def validate():
     return "*Mean squared error*: {:.3f} vs {:.3f} baseline".format(
         model, baseline
     )
+
+
+def runs():
+    params = models.PredictionParameter.objects.filter(
+        run__finished__isnull=False
+    ).order_by('-run__finished', '-run').select_related('run')
+    current = models.PredictionRun.current()
+    return "".join([
+        "*Run {}*: {:%Y-%m-%d %H:%M}, log(P) = {:.1f}{}\n".format(
+            p.run.pk, timezone.localtime(p.run.finished), p.lp,
+            " (current)" if p.run == current else ""
+        ) for p in params
+    ])
@@ -16,6 +16,11 @@ def init(parser):
         action='store_true',
         help='Create or overwrite a stored query'
     )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Run the query again even if its result is cached'
+    )
     parser.add_argument(
         'params',
         nargs='*',
@@ -63,7 +68,9 @@ def query(request):
                 "Could not find saved query `{}`".format(args.name)
             )
         return SlashCommandResponse(
-            sql.run_sql_command(q.command, args.params)
+            sql.run_sql_command(
+                q.command, args.params, cache=not args.no_cache
+            )
         )
 
     # Finally, just echo the list of all queries
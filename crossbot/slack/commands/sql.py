@@ -1,11 +1,19 @@
 import html
 import logging
-import multiprocessing
+import os
 import re
-import sqlite3
 import traceback
 
 from . import models, DB_PATH, SlashCommandResponse
+from ...settings import (
+    SQL_WORKERS, SQL_WORKER_MAX_QUERIES, SQL_TIMEOUT, SQL_SNAPSHOT_PATH,
+    SQL_SNAPSHOT_MAX_AGE, SQL_CACHE_SIZE, SQL_MAX_BYTES
+)
+from ...sql_sandbox import (
+    SandboxPool, QueryTimeout, take_snapshot, snapshot_age, snapshot_file,
+    snapshot_version
+)
+from ...util import LRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -17,38 +25,103 @@ def init(parser):
     parser.add_argument(
         'sql_command',
         nargs='*',
-        help='sql command to run again at table of (user, date, seconds)'
+        help='sql command to run against the tables ' +
+        ', '.join(SNAPSHOT_TABLES)
     )
 
 
-SAFE_SQL_OPS = (
-    sqlite3.SQLITE_SELECT,
-    sqlite3.SQLITE_READ,
-    31,  # sqlite3.SQLITE_FUNCTION
-)
-
-ALLOWED_TABLES = {
-    models.MiniCrosswordTime._meta.db_table: ["mini_crossword_time"]
-}
+def _name(user_id):
+    return (
+        "COALESCE(NULLIF(u.slack_fullname, ''), NULLIF(u.slackname, ''), {}) "
+        "AS name".format(user_id)
+    )
 
 
-def _allow_only_select(operation, arg1, arg2, db_name, trigger):
-    if operation not in SAFE_SQL_OPS:
-        return sqlite3.SQLITE_DENY
+def _time_table(time_model):
+    return """
+        SELECT t.*, {name}
+        FROM live.{time} AS t
+        LEFT JOIN live.{user} AS u ON u.slackid = t.user_id
+    """.format(
+        name=_name('t.user_id'),
+        time=time_model._meta.db_table,
+        user=models.CBUser._meta.db_table,
+    )
 
-    if operation != sqlite3.SQLITE_READ:
-        return sqlite3.SQLITE_OK
 
-    table_name = arg1
-    logger.debug(
-        'should allow %s %s %s? %s', operation, arg1, arg2,
-        table_name in ALLOWED_TABLES
+def _prediction_table(model, columns, joins=''):
+    return """
+        SELECT {columns}
+        FROM live.{data} AS p {joins}
+        WHERE p.run_id = (
+            SELECT id FROM live.{run} WHERE finished IS NOT NULL
+            ORDER BY finished DESC, id DESC LIMIT 1
+        )
+    """.format(
+        columns=columns,
+        data=model._meta.db_table,
+        joins=joins,
+        run=models.PredictionRun._meta.db_table,
     )
 
-    if table_name not in ALLOWED_TABLES:
-        return sqlite3.SQLITE_DENY
 
-    return sqlite3.SQLITE_OK
+# The tables users can query, and the SELECTs on the live database that fill
+# them in the snapshot. The predictions are from the current run.
+SNAPSHOT_TABLES = {
+    'mini_crossword_time':
+    _time_table(models.MiniCrosswordTime),
+    'crossword_time':
+    _time_table(models.CrosswordTime),
+    'sudoku_time':
+    _time_table(models.EasySudokuTime),
+    'users':
+    """
+        SELECT u.slackid AS user_id, {name}, u.slackname, u.slack_fullname,
+               u.crossbucks, u.deactivated
+        FROM live.{user} AS u
+    """.format(name=_name('u.slackid'), user=models.CBUser._meta.db_table),
+    'predictions':
+    _prediction_table(
+        models.Prediction,
+        't.user_id, {}, t.date, t.seconds, p.prediction, p.residual'.format(
+            _name('t.user_id')
+        ),
+        """
+            JOIN live.{time} AS t ON t.id = p.time_id
+            LEFT JOIN live.{user} AS u ON u.slackid = t.user_id
+        """.format(
+            time=models.MiniCrosswordTime._meta.db_table,
+            user=models.CBUser._meta.db_table,
+        ),
+    ),
+    'skills':
+    _prediction_table(
+        models.PredictionUser,
+        'p.user_id, {}, p.skill, p.skill_25, p.skill_75'.format(
+            _name('p.user_id')
+        ),
+        'LEFT JOIN live.{} AS u ON u.slackid = p.user_id'.format(
+            models.CBUser._meta.db_table
+        ),
+    ),
+    'difficulties':
+    _prediction_table(
+        models.PredictionDate,
+        'p.date, p.difficulty, p.difficulty_25, p.difficulty_75',
+    ),
+}
+
+SNAPSHOT_PATH = SQL_SNAPSHOT_PATH or (
+    os.path.splitext(DB_PATH)[0] + '.snapshot.db'
+)
+
+POOL = SandboxPool(
+    SNAPSHOT_PATH,
+    SNAPSHOT_TABLES,
+    processes=SQL_WORKERS,
+    max_queries=SQL_WORKER_MAX_QUERIES,
+    timeout=SQL_TIMEOUT,
+)
 
 
 def fmt_tup(tup):
@@ -60,51 +133,95 @@ def fmt_tup(tup):
 
     if len(tup) > 10:
         msg = 'tuple was {} elems, truncating...'.format(len(tup))
-        tup = tup[:10]
+        tup = list(tup[:10])
         tup.append(msg)
     return ', '.join(fmt_elem(elem) for elem in tup)
 
 
-def _do_sql(cmd, *args):
-    """Function used by async worker, internal use only.
+SLACKID_RX = re.compile(r'(U[A-Z0-9]{8})')
+
 
-    Assumes the command and args have already been sanitized.
+# Results of saved queries, keyed on (command, args, snapshot). Besides the
+# times, the snapshot has tables like users and predictions that can change
+# without the version changing, so it's identified by its file as well.
+CACHE = LRUCache(maxsize=SQL_CACHE_SIZE, ttl=SQL_SNAPSHOT_MAX_AGE)
+
+
+def _run(cmd, args, snapshot, cache):
+    if not cache:
+        return POOL.run(cmd, args, max_rows=20, max_bytes=SQL_MAX_BYTES)
+
+    key = (cmd, tuple(args), snapshot)
+    result = CACHE.get(key)
+    if result is None:
+        result = POOL.run(cmd, args, max_rows=20, max_bytes=SQL_MAX_BYTES)
+        CACHE.set(key, result)
+    return result
+
+
+def _do_sql(cmd, *args, snapshot=None, cache=False):
+    """Runs the command in the sandbox and formats the result.
+
+    Assumes the command and args have already been sanitized. If cache is
+    true, the result for the same command, args and snapshot (as returned
+    by current_snapshot) is reused.
     """
-    with sqlite3.connect(DB_PATH) as con:
-        con.set_authorizer(_allow_only_select)
-        # con.create_function('user_str', 1, user_str)
-        try:
-            rows = con.execute(cmd, args).fetchall()
-
-            # Truncate to 20 rows
-            if len(rows) > 20:
-                msg = 'result was {} rows, truncating...'.format(len(rows))
-                rows = rows[:20]
-                rows.append((msg, ))
-
-            result = '\n'.join(fmt_tup(tup) for tup in rows)
-
-            # Replace slackids with slacknames
-            def username_from_slackid(m):
-                slackid = m.group(1)
-                user = models.CBUser.from_slackid(slackid)
-                if user:
-                    return str(user)
-                else:
-                    logger.debug("Can't find slack name for %s", slackid)
-                return slackid
-
-            logger.debug('result %s', result)
-            result = re.sub(r'(U[A-Z0-9]{8})', username_from_slackid, result)
-
-            return result
-
-        except Exception as e:
-            tb = traceback.format_exc()
-            logger.info(
-                'sql exception. command:\n%s\n exception: %s\n%s', cmd, e, tb
+    try:
+        rows, truncated = _run(cmd, args, snapshot, cache)
+
+        # The sandbox stops after 20 rows, or SQL_MAX_BYTES
+        rows = list(rows)
+        if truncated:
+            msg = 'result was more than {} rows, truncating...'.format(
+                len(rows)
             )
-            return str(e) + ', this incident has been reported'
+            rows.append((msg, ))
+
+        result = '\n'.join(fmt_tup(tup) for tup in rows)
+    except QueryTimeout:
+        raise
+    except Exception as e:
+        tb = traceback.format_exc()
+        logger.info(
+            'sql exception. command:\n%s\n exception: %s\n%s', cmd, e, tb
+        )
+        return str(e) + ', this incident has been reported'
+
+    # Replace slackids with slacknames
+    logger.debug('result %s', result)
+    names = models.CBUser.names_for(SLACKID_RX.findall(result))
+    return SLACKID_RX.sub(lambda m: names.get(m.group(1), m.group(1)), result)
+
+
+def refresh_snapshot(force=False):
+    """Retake the snapshot if the times have changed since it was taken, or
+    it's older than SQL_SNAPSHOT_MAX_AGE. The SqlSnapshot cron job calls
+    this.
+
+    Returns the snapshot's version.
+    """
+    version = models.DataVersion.total()
+    age = snapshot_age(SNAPSHOT_PATH)
+    if (
+            force or age is None or age > SQL_SNAPSHOT_MAX_AGE
+            or snapshot_version(SNAPSHOT_PATH) != version
+    ):
+        take_snapshot(DB_PATH, SNAPSHOT_PATH, SNAPSHOT_TABLES, version)
+    return version
+
+
+def current_snapshot():
+    """Identifies the snapshot queries will run against by its version and
+    file (see snapshot_file).
+
+    The snapshot is only taken here if there isn't one yet. Otherwise the
+    SqlSnapshot cron job keeps it fresh, so commands don't wait on copying
+    the live database.
+    """
+    version = snapshot_version(SNAPSHOT_PATH)
+    if version is None:
+        version = refresh_snapshot(force=True)
+    return version, snapshot_file(SNAPSHOT_PATH)
 
 
 def _format_sql_cmd(cmd):
@@ -117,16 +234,15 @@ def _format_sql_cmd(cmd):
                                               "'").replace(u"\u201d", "'")
     )
 
-    # Now, replace the table names to help mask Django craziness
-    for db_table, names in ALLOWED_TABLES.items():
-        for name in names:
-            cmd = cmd.replace(name, db_table)
-
     return cmd
 
 
-def run_sql_command(raw_cmd, args):
-    """Formats the command and runs it safely."""
+def run_sql_command(raw_cmd, args, cache=False):
+    """Formats the command and runs it safely.
+
+    If cache is true, a cached result is used if the snapshot hasn't
+    changed.
+    """
 
     logger.debug("raw command: %s | %s", raw_cmd, args)
 
@@ -135,11 +251,12 @@ def run_sql_command(raw_cmd, args):
 
     logger.debug("formatted command: %s | %s", cmd, args)
 
+    snapshot = current_snapshot()
     try:
-        with multiprocessing.Pool() as pool:
-            result = pool.apply_async(_do_sql, [cmd] + args).get(1)
-            return raw_cmd + '\n\n' + result
-    except multiprocessing.TimeoutError:
+        return raw_cmd + '\n\n' + _do_sql(
+            cmd, *args, snapshot=snapshot, cache=cache
+        )
+    except QueryTimeout:
         return "dont try to dos me, this incident has been reported"
 
 
@@ -149,4 +266,8 @@ def sql(request):
         cmd = ' '.join(request.args.sql_command)
         return SlashCommandResponse(run_sql_command(cmd, []))
     else:
-        return SlashCommandResponse("Please type some sql.")
+        return SlashCommandResponse(
+            "Please type some sql. The tables are {}.".format(
+                ', '.join('`{}`'.format(t) for t in SNAPSHOT_TABLES)
+            )
+        )
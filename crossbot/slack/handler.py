@@ -1,7 +1,7 @@
 from .parser import Parser, ParserException
 from . import commands
 from .message import SlashCommandRequest, Message
-from .api import post_response, post_message, react
+from . import outbox
 
 PARSER = Parser()
 
@@ -9,6 +9,8 @@ for mod_name in commands.COMMANDS:
     mod = getattr(commands, mod_name)
     mod.init(PARSER)
 
+PARSER.compile()
+
 
 def handle_slash_command(django_request):
     """ Parses the request and calls the right command.
@@ -38,18 +40,18 @@ def handle_slash_command(django_request):
                 # You can't impersonate or react w/ ephemeral
                 assert not msg.ephemeral
 
-                # For now, simply let permissions errors bubble up. Each command
-                # should properly check the request channel so that the bot has
-                # correct permissions
-                timestamp = post_message(
+                # Queue the message rather than waiting on Slack. Each command
+                # should properly check the request channel so that the bot
+                # has correct permissions, otherwise the message will fail to
+                # send in the background.
+                post = outbox.post_message(
                     request.channel, msg.asdict(include_response_type=False)
                 )
-                for reaction in msg.reactions:
-                    react(reaction, request.channel, timestamp)
+                outbox.react(msg.reactions, post)
             else:
                 if should_return:
                     return msg.asdict()
-                post_response(request.response_url, msg.asdict())
+                outbox.post_response(request.response_url, msg.asdict())
             return default_ret_val
 
         if emsg and dmsg:
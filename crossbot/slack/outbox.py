@@ -0,0 +1,261 @@
+"""Queue messages to Slack, and send them in the background.
+
+Slash commands have to be acknowledged within 3 seconds, so instead of
+calling Slack while handling the command, messages and reactions are saved
+as SlackOutboxMessages and sent by a background thread in the same process.
+
+Messages to the same channel (or response url) are sent in the order they
+were queued. A message that fails to send is retried with exponential
+backoff, and the messages queued after it wait until it's sent or given up
+on. Reactions are sent once the message they are on has been posted, all
+at once, and don't hold up the rest of the channel.
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from . import api
+from ..models import SlackOutboxMessage as Outbox
+from ..settings import SLACK_OUTBOX_ASYNC, SLACK_OUTBOX_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# Messages claimed longer ago than this were abandoned by a dead process
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def post_message(channel, message_dict):
+    """Queue message_dict to be posted to channel.
+
+    Returns the queued message, which reactions can be added to.
+    """
+    return _queue(Outbox.POST, channel, message_dict)
+
+
+def react(emojis, message):
+    """Queue reactions to a message queued with post_message.
+
+    Deduplication is per message only: emojis repeated in emojis or
+    already queued for this message are skipped, but the same emoji may
+    still be queued on other messages, even ones from the same response.
+    """
+    queued = {
+        json.loads(payload)['name']
+        for payload in Outbox.objects.filter(parent=message, kind=Outbox.REACT
+                                             ).values_list('payload', flat=True)
+    }
+
+    reactions = []
+    for emoji in emojis:
+        if emoji not in queued:
+            queued.add(emoji)
+            reactions.append(
+                Outbox(
+                    kind=Outbox.REACT,
+                    key=message.key,
+                    payload=json.dumps({'name': emoji}),
+                    parent=message
+                )
+            )
+
+    Outbox.objects.bulk_create(reactions)
+    wake()
+
+
+def post_response(response_url, message_dict):
+    """Queue message_dict to be posted to a slash command's response url."""
+    return _queue(Outbox.RESPONSE, response_url, message_dict)
+
+
+def _queue(kind, key, payload, parent=None):
+    message = Outbox.objects.create(
+        kind=kind, key=key, payload=json.dumps(payload), parent=parent
+    )
+    wake()
+    return message
+
+
+def wake():
+    """Start sending any queued messages."""
+    if SLACK_OUTBOX_ASYNC:
+        # Only once the messages are committed, so the worker can see them
+        transaction.on_commit(_worker().wake)
+    else:
+        deliver_due()
+
+
+def _claim(message, now):
+    claimed = Outbox.objects.filter(
+        pk=message.pk, state=Outbox.PENDING
+    ).update(state=Outbox.SENDING, claimed=now)
+    if claimed:
+        message.state, message.claimed = Outbox.SENDING, now
+    return claimed
+
+
+def claim_next():
+    """Claim the next messages that are due to be sent.
+
+    Returns a list of messages, which is empty if none are due. Only the
+    oldest unsent message for each key can be claimed, which keeps each
+    channel in order. Reactions can be claimed once their message is sent,
+    and are claimed together with the other reactions to the same message.
+    """
+    now = timezone.now()
+    Outbox.objects.filter(
+        state=Outbox.SENDING, claimed__lt=now - CLAIM_TIMEOUT
+    ).update(state=Outbox.PENDING)
+
+    unsent = Outbox.objects.filter(state__in=[Outbox.PENDING, Outbox.SENDING])
+    heads = unsent.exclude(kind=Outbox.REACT).values('key').annotate(
+        first=models.Min('pk')
+    )
+    due = Outbox.objects.filter(state=Outbox.PENDING, next_attempt__lte=now)
+
+    for message in due.filter(
+            models.Q(pk__in=heads.values('first'))
+            | models.Q(kind=Outbox.REACT, parent__state=Outbox.SENT)
+    ).select_related('parent').order_by('pk'):
+        if not _claim(message, now):
+            continue
+        if message.kind != Outbox.REACT:
+            return [message]
+
+        siblings = due.filter(
+            kind=Outbox.REACT, parent=message.parent, pk__gt=message.pk
+        ).order_by('pk')
+        return [message] + [m for m in siblings if _claim(m, now)]
+
+    return []
+
+
+def _finish(message, error=None):
+    """Mark a claimed message as sent, or schedule it to be retried."""
+    if error is None:
+        message.state = Outbox.SENT
+        message.sent = timezone.now()
+        message.save()
+        return True
+
+    message.attempts += 1
+    message.error = repr(error)
+    if message.attempts >= SLACK_OUTBOX_MAX_ATTEMPTS:
+        logger.error('Giving up on sending %s: %r', message, error)
+        message.state = Outbox.FAILED
+        # Its reactions can't be sent either
+        Outbox.objects.filter(
+            parent=message, state=Outbox.PENDING
+        ).update(state=Outbox.FAILED, error='Message was never posted')
+    else:
+        logger.warning('Failed to send %s: %r', message, error)
+        message.state = Outbox.PENDING
+        message.next_attempt = timezone.now() + timedelta(
+            seconds=2**message.attempts
+        )
+    message.save()
+    return False
+
+
+def deliver(messages):
+    """Send a list of claimed messages from claim_next.
+
+    Returns how many were sent.
+    """
+    if messages[0].kind == Outbox.REACT:
+        parent = messages[0].parent
+        names = [json.loads(m.payload)['name'] for m in messages]
+        try:
+            errors = api.react_all(names, parent.key, parent.ts)
+        except Exception as e:
+            errors = {name: e for name in names}
+        return sum(_finish(m, errors[n]) for m, n in zip(messages, names))
+
+    message, = messages
+    payload = json.loads(message.payload)
+    try:
+        if message.kind == Outbox.POST:
+            message.ts = api.post_message(message.key, payload)
+        elif message.kind == Outbox.RESPONSE:
+            if not api.post_response(message.key, payload):
+                raise ValueError('response url did not accept the message')
+        else:
+            raise ValueError('invalid kind: ' + message.kind)
+    except Exception as e:
+        return _finish(message, e)
+    return _finish(message)
+
+
+def deliver_due():
+    """Send every message that is due. Returns how many were sent."""
+    sent = 0
+    messages = claim_next()
+    while messages:
+        sent += deliver(messages)
+        messages = claim_next()
+    return sent
+
+
+def prune(age=timedelta(days=1)):
+    """Delete the messages that were sent longer than age ago."""
+    return Outbox.objects.filter(
+        state=Outbox.SENT, sent__lt=timezone.now() - age
+    ).delete()
+
+
+def next_due():
+    """Seconds until the next retry is due, or None if nothing is waiting."""
+    next_attempt = Outbox.objects.filter(state=Outbox.PENDING).aggregate(
+        models.Min('next_attempt')
+    )['next_attempt__min']
+    if next_attempt is None:
+        return None
+    # Wait at least a second, in case the message is stuck behind one that
+    # another process is sending
+    return max((next_attempt - timezone.now()).total_seconds(), 1)
+
+
+class Worker(threading.Thread):
+    """Sends queued messages whenever it's woken up or a retry is due."""
+
+    def __init__(self):
+        super().__init__(name='slack-outbox', daemon=True)
+        self.event = threading.Event()
+
+    def wake(self):
+        self.event.set()
+
+    def run(self):
+        timeout = 0  # Send anything left over by a previous process
+        while True:
+            self.event.wait(timeout)
+            self.event.clear()
+            try:
+                deliver_due()
+                timeout = next_due()
+            except Exception:
+                logger.exception('Failed to deliver the Slack outbox')
+                timeout = 60
+            finally:
+                connection.close()
+
+
+_worker_lock = threading.Lock()
+_worker_instance = None
+_worker_pid = None
+
+
+def _worker():
+    """The process's worker, started on first use (and again after a fork)."""
+    global _worker_instance, _worker_pid
+    with _worker_lock:
+        if _worker_instance is None or _worker_pid != os.getpid():
+            _worker_instance = Worker()
+            _worker_pid = os.getpid()
+            _worker_instance.start()
+        return _worker_instance
@@ -84,12 +84,30 @@ class Parser:
         help_parser.set_defaults(command='help')
         help_parser.add_argument('help_subcommands', nargs='*')
 
+        self._commands = None
+
+    def compile(self):
+        """Build the dispatch table and help text once all the commands have
+        been added. Adding commands afterwards requires compiling again."""
+        # subcommand name (or alias) -> its parser
+        self._commands = dict(self.subparsers.choices)
+        self._help = {
+            name: subparser.format_help()
+            for name, subparser in self._commands.items()
+        }
+        self._main_help = self.parser.format_help()
+        # what the global options default to when none are given
+        self._defaults = vars(self.parser.parse_args([]))
+
     def print_help(self, args):
         # always raises ParserException so the client can print how it wants
 
         if getattr(args, 'help_subcommands', False):
             msg = ''
             for cmd in args.help_subcommands:
+                if cmd in self._help:
+                    msg += self._help[cmd]
+                    continue
                 try:
                     self.parser.parse_args([cmd, '--help'])
                 except ParserException as e:
@@ -98,12 +116,32 @@ class Parser:
 
         else:
             # no subcommands specified, just print the regular message
-            self.parser.print_help()
+            raise ParserException(self._main_help)
+
+    def _parse_args(self, words):
+        # Most commands start with the subcommand, so only its parser needs
+        # to run. Anything else, like global options, goes through the
+        # whole parser.
+        subparser = self._commands.get(words[0]) if words else None
+        if subparser is None:
+            return self.parser.parse_args(words)
+
+        options = words[1:words.index('--')] if '--' in words else words[1:]
+        if '-h' in options or '--help' in options:
+            raise ParserException(self._help[words[0]])
+
+        args = argparse.Namespace(**self._defaults)
+        for key, value in vars(subparser.parse_args(words[1:])).items():
+            setattr(args, key, value)
+        return args
 
     def parse(self, string):
         # will raise ParserException if it fails or prints help
 
-        args = self.parser.parse_args(string.split())
+        if self._commands is None:
+            self.compile()
+
+        args = self._parse_args(string.split())
         command = getattr(args, 'command', None)
 
         if command is None or command == 'help':
@@ -0,0 +1,255 @@
+"""A pool of sandboxed worker processes for running users' SQL.
+
+Users' queries run against a snapshot of the database (see take_snapshot),
+so they never hold locks on the live one. Each worker keeps its own
+read-only connection to the snapshot, with an authorizer that only allows
+reading some tables, and a progress handler that interrupts queries that run
+too long. Workers are replaced after a
+number of queries, and the whole pool is replaced if a worker stops
+responding.
+
+This module doesn't import Django, so the workers start quickly and don't
+inherit the web process's state.
+"""
+
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.request import pathname2url
+
+logger = logging.getLogger(__name__)
+
+SAFE_SQL_OPS = (
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    31,  # sqlite3.SQLITE_FUNCTION
+)
+
+# How many SQLite VM instructions to run between checks of the deadline
+PROGRESS_INTERVAL = 1000
+
+# How much longer than the timeout to wait on a worker before giving up on it
+GRACE_PERIOD = 1
+
+
+class QueryTimeout(Exception):
+    """The query took longer than the timeout."""
+
+
+def make_authorizer(allowed_tables):
+    def authorizer(operation, arg1, arg2, db_name, trigger):
+        if operation not in SAFE_SQL_OPS:
+            return sqlite3.SQLITE_DENY
+
+        if operation != sqlite3.SQLITE_READ:
+            return sqlite3.SQLITE_OK
+
+        if arg1 not in allowed_tables:
+            return sqlite3.SQLITE_DENY
+
+        return sqlite3.SQLITE_OK
+
+    return authorizer
+
+
+def _uri(path, **params):
+    query = '&'.join('{}={}'.format(k, v) for k, v in params.items())
+    return 'file:{}{}'.format(pathname2url(path), '?' + query if query else '')
+
+
+def take_snapshot(db_path, snapshot_path, tables, version=0):
+    """Atomically replace snapshot_path with a snapshot of db_path.
+
+    tables maps the name of each table in the snapshot to a SELECT that
+    fills it, which reads the live database as "live". The SELECTs run in
+    one read transaction, so the tables are consistent with each other.
+    The snapshot is labeled with version (see snapshot_version).
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(snapshot_path)),
+        prefix='.tmp.',
+        suffix='.db'
+    )
+    os.close(fd)
+    try:
+        con = sqlite3.connect(_uri(tmp_path), uri=True, isolation_level=None)
+        try:
+            con.execute(
+                'ATTACH DATABASE ? AS live', [_uri(db_path, mode='ro')]
+            )
+            con.execute('BEGIN')
+            for name, select in tables.items():
+                con.execute('CREATE TABLE "{}" AS {}'.format(name, select))
+            con.execute('PRAGMA user_version = {:d}'.format(version))
+            con.execute('COMMIT')
+            con.execute('DETACH DATABASE live')
+        finally:
+            con.close()
+        os.replace(tmp_path, snapshot_path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def snapshot_age(snapshot_path):
+    """Seconds since the snapshot was taken, or None if there isn't one."""
+    try:
+        return time.time() - os.path.getmtime(snapshot_path)
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_file(snapshot_path):
+    """The snapshot's (inode, mtime in ns), which change whenever it's
+    replaced, or None if there isn't one."""
+    try:
+        st = os.stat(snapshot_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def snapshot_version(snapshot_path):
+    """The version the snapshot was labeled with, or None if there isn't
+    one."""
+    try:
+        con = sqlite3.connect(_uri(snapshot_path, mode='ro'), uri=True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        return con.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        con.close()
+
+
+# State of a worker process
+_db_path = None
+_allowed_tables = None
+_connection = None
+_connected_to = None
+_deadline = None
+
+
+def _connect():
+    global _connection, _connected_to
+    if _connection is not None:
+        _connection.close()
+    _connected_to = snapshot_file(_db_path)
+    _connection = sqlite3.connect(_uri(_db_path, mode='ro'), uri=True)
+    _connection.set_authorizer(make_authorizer(_allowed_tables))
+    _connection.set_progress_handler(_past_deadline, PROGRESS_INTERVAL)
+
+
+def _past_deadline():
+    # Returning true interrupts the query
+    return _deadline is not None and time.monotonic() > _deadline
+
+
+def _init_worker(db_path, allowed_tables):
+    global _db_path, _allowed_tables
+    _db_path, _allowed_tables = db_path, frozenset(allowed_tables)
+    _connect()
+
+
+def _size(value):
+    """Roughly how many bytes a value takes up."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+
+def _run(cmd, args, timeout, max_rows, max_bytes):
+    """Run cmd in a worker.
+
+    Returns at most max_rows rows taking up at most about max_bytes, and
+    whether there were more rows than that. The first row is returned even
+    if it alone is over max_bytes. Rows past the limits are never fetched.
+    """
+    global _deadline
+
+    # Reconnect if the snapshot has been replaced
+    if snapshot_file(_db_path) != _connected_to:
+        _connect()
+
+    _deadline = time.monotonic() + timeout
+    try:
+        cursor = _connection.execute(cmd, args)
+        rows, size = [], 0
+        while len(rows) < max_rows:
+            batch = cursor.fetchmany(max_rows - len(rows))
+            if not batch:
+                return rows, False
+            for row in batch:
+                size += sum(_size(value) for value in row)
+                if size > max_bytes and rows:
+                    return rows, True
+                rows.append(row)
+        return rows, cursor.fetchone() is not None
+    except sqlite3.OperationalError as e:
+        if str(e) != 'interrupted':
+            raise
+        # Start over with a fresh connection after an interrupted query
+        _connect()
+        raise QueryTimeout()
+    finally:
+        _deadline = None
+
+
+class SandboxPool:
+    """A lazily started pool of workers for running read-only queries."""
+
+    def __init__(
+            self, db_path, allowed_tables, *, processes, max_queries, timeout
+    ):
+        self.db_path = db_path
+        self.allowed_tables = list(allowed_tables)
+        self.processes = processes
+        self.max_queries = max_queries
+        self.timeout = timeout
+
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            # A forked process can't use its parent's pool
+            if self._pool is None or self._pid != os.getpid():
+                context = multiprocessing.get_context('forkserver')
+                self._pool = context.Pool(
+                    self.processes,
+                    initializer=_init_worker,
+                    initargs=(self.db_path, self.allowed_tables),
+                    maxtasksperchild=self.max_queries,
+                )
+                self._pid = os.getpid()
+            return self._pool
+
+    def recycle(self):
+        """Replace all the workers."""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.terminate()
+            self._pool = None
+
+    def run(self, cmd, args=(), max_rows=20, max_bytes=16384):
+        """Run cmd in a worker.
+
+        Returns at most max_rows rows taking up at most about max_bytes,
+        and whether the result was truncated to fit. Raises QueryTimeout if
+        the query takes too long, and re-raises any other error from
+        running it.
+        """
+        result = self._get_pool().apply_async(
+            _run, (cmd, list(args), self.timeout, max_rows, max_bytes)
+        )
+        try:
+            return result.get(self.timeout + GRACE_PERIOD)
+        except multiprocessing.TimeoutError:
+            logger.warning('SQL worker stopped responding, recycling the pool')
+            self.recycle()
+            raise QueryTimeout()
@@ -0,0 +1,130 @@
+"""On-disk cache of compiled Stan models, shared between processes.
+
+Compiling a model takes minutes, so the compiled StanModel is pickled into
+PREDICTOR_CACHE_DIR, keyed by a hash of its code. Compiles are serialized
+with a lock file so only one process does the work, and pickles are written
+to a temporary file and renamed into place, so readers never see a
+partially written model.
+"""
+
+import fcntl
+import logging
+import os
+import pickle
+import tempfile
+from contextlib import contextmanager
+from hashlib import md5
+
+from .settings import PREDICTOR_CACHE_DIR
+from .util import LazyModule
+
+pystan = LazyModule('pystan')
+
+logger = logging.getLogger(__name__)
+
+# What unpickling a truncated, stale or otherwise broken model can raise.
+# Anything else (like running out of memory) says nothing about the file.
+CORRUPT_ERRORS = (
+    pickle.UnpicklingError,
+    EOFError,
+    AttributeError,
+    ImportError,
+    IndexError,
+    TypeError,
+    ValueError,
+)
+
+
+class CorruptModelError(Exception):
+    """A cached model exists, but can't be loaded."""
+
+
+def cache_dir():
+    return os.path.expanduser(PREDICTOR_CACHE_DIR)
+
+
+def model_path(code, name='predictor'):
+    hash = md5(code.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir(), '{}.{}.model'.format(name, hash))
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on the lock file next to path."""
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read(path):
+    """Load the model at path, or None if it isn't cached."""
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except CORRUPT_ERRORS as e:
+        raise CorruptModelError(path) from e
+
+
+def write(path, sm):
+    """Atomically replace the model at path with sm."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.tmp.', suffix='.model'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(sm, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def evict(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def load(path):
+    """Like read, but evicts the model at path if it's corrupt."""
+    try:
+        return read(path)
+    except CorruptModelError:
+        logger.exception('Evicting corrupt cached model %s', path)
+        evict(path)
+        return None
+
+
+def compile_model(code):
+    logger.info('Compiling model, please wait')
+    return pystan.StanModel(model_code=code)
+
+
+def get_model(code, name='predictor', force=False, compiler=compile_model):
+    """Get the compiled model for code, compiling and caching it if needed.
+
+    If force is set, the model is recompiled even if it's cached. compiler
+    turns code into a model.
+    """
+    os.makedirs(cache_dir(), exist_ok=True)
+    path = model_path(code, name)
+
+    sm = None if force else load(path)
+    if sm is not None:
+        return sm
+
+    with locked(path):
+        # Another process may have compiled the model while we waited
+        sm = None if force else load(path)
+        if sm is None:
+            sm = compiler(code)
+            write(path, sm)
+    return sm
@@ -5,265 +5,180 @@ const TIME_MODEL_NAME_MAP = {
   'easysudoku': "Easy Sudoku",
 }
 
-//adapted from https://stackoverflow.com/questions/48719873/how-to-get-median-and-quartiles-percentiles-of-an-array-in-javascript-or-php
-//adapted from https://blog.poettner.de/2011/06/09/simple-statistics-with-php/
-Array.prototype.quartile = function(q) {
-  var data = this.slice();
-  data.sort(); // TODO: fix sorting here and everywhere else, use function
-  var pos = ((data.length) - 1) * q;
-  var base = Math.floor(pos);
-  var rest = pos - base;
-  if( (data[base+1]!==undefined) ) {
-    return data[base] + rest * (data[base+1] - data[base]);
-  } else {
-    return data[base];
-  }
-}
-
-Array.prototype.quartile_75 = function() {
-  return this.quartile(0.75);
-}
-Array.prototype.quartile_50 = function() {
-  return this.quartile(0.50);
-}
-Array.prototype.quartile_25 = function() {
-  return this.quartile(0.25);
-}
-Array.prototype.median = function() {
-  return this.quartile_50();
+function toVal(date) {
+  return date.toISOString().split('T')[0];
 }
 
-Array.prototype.sum = function() {
-   return this.reduce(function(a, b) { return a + b; }, 0);
+function setDefaultDates() {
+  var d = new Date();
+  $('#plot-settings input[name="end-date"]').val(toVal(d));
+  d.setDate(d.getDate() - 30);
+  $('#plot-settings input[name="start-date"]').val(toVal(d));
 }
 
-Array.prototype.average = function() {
-  if (this.length == 0) {
-    return 0;
+// Insert nulls between days that aren't consecutive, so plotly breaks the line
+function withGaps(dates, values) {
+  var x = [];
+  var y = [];
+  for (var i = 0; i < dates.length; i++) {
+    if (i > 0) {
+      // TODO: I think this breaks on DST (Mar 11)
+      var next = new Date(dates[i - 1]);
+      next.setDate(next.getDate() + 1);
+      if (next < new Date(dates[i])) {
+        x.push(null);
+        y.push(null);
+      }
+    }
+    x.push(dates[i]);
+    y.push(values[i]);
   }
-  return this.sum() / this.length;
-}
-
-Array.prototype.stdev = function() {
-   var mean = this.average();
-   return Math.sqrt(this.map(x => Math.pow(x - mean, 2)).average());
+  return {x: x, y: y};
 }
 
-// function setDefaultDates() {
-//   var d = new Date();
-
-//   function toVal(date) {
-//     return date.toISOString().split('T')[0];
-//   }
-
-//   $('#plot-settings input[name="end-date"]').val(toVal(d));
-//   d.setDate(d.getDate() - 10);
-//   $('#plot-settings input[name="start-date"]').val(toVal(d));
-// }
-
 function plotData(data) {
-  var times = data.times;
-
-  // Normalize the data if necessary
-  if($('#plot-settings input[name="plot-mode"][value="normalized"]').is(':checked')) {
-    times = normalizeTimes(data.times);
-  }
-
-  const today = new Date();
-  const one_week_ago = new Date(today);
-  one_week_ago.setDate(one_week_ago.getDate() - 7);
-  var end = data['end'];
-  if (new Date(end) > today) {
-    end = today;
+  const normalized = $('#plot-settings input[name="plot-mode"][value="normalized"]').is(':checked');
+  const log = $('#plot-settings input[name="scale-mode"][value="log"]').is(':checked');
+
+  var traces = [];
+
+  // The middle half of each day's times, behind everyone's own times
+  if (!normalized) {
+    var q = data.quartiles;
+    traces.push({
+      type: 'scatter',
+      name: '25th percentile',
+      x: q.dates,
+      y: q.q25,
+      mode: 'lines',
+      line: {width: 0},
+      showlegend: false,
+      hoverinfo: 'skip',
+    });
+    traces.push({
+      type: 'scatter',
+      name: 'Middle half',
+      x: q.dates,
+      y: q.q75,
+      mode: 'lines',
+      line: {width: 0},
+      fill: 'tonexty',
+      fillcolor: 'rgba(128, 128, 128, 0.2)',
+    });
+    traces.push({
+      type: 'scatter',
+      name: 'Median',
+      x: q.dates,
+      y: q.median,
+      mode: 'lines',
+      line: {color: 'gray', dash: 'dot'},
+    });
   }
 
-  // First, compile the times into user data
-  var userDataMap = {};
-  window.userDataMap = userDataMap;
-  for (var time of times) {
-    // Discard future times
-    if (new Date(time.date) > new Date(end)) {
-      continue;
-    }
-
-    if (!(time.user in userDataMap)) {
-      userDataMap[time.user] = {
-        type: 'scattergl',
-        name: time.user,
-        mode: 'lines+markers',
-        connectgaps: false,
-        x: [],
-        y: [],
-      }
-    } else {
-      // Push enough nulls to bring us up to date
-      // TODO: I think this breaks on DST (Mar 11)
-      var u = userDataMap[time.user];
-      var prev = new Date(u.x[u.x.length - 1]);
-      prev.setDate(prev.getDate() + 1)
-      var next = new Date(time.date);
-      if (prev < next) {
-        u.x.push(null);
-        u.y.push(null);
-      }
+  var users = Object.keys(data.users).sort(
+    (a, b) => data.users[a].name.localeCompare(data.users[b].name)
+  );
+  for (var user of users) {
+    var u = data.users[user];
+    var values = normalized ? u.scores : u.seconds;
+    var dates = u.dates;
+    if (!normalized) {
+      // don't plot failures as times
+      dates = dates.filter((d, i) => values[i] > 0);
+      values = values.filter(v => v > 0);
     }
-    var u = userDataMap[time.user];
-    u.x.push(time.date);
-    u.y.push(time.seconds);
-  }
-
-  var userData = [];
-  window.userData = userData;
-  for (var user in userDataMap) {
-    userData.push(userDataMap[user]);
+    var points = withGaps(dates, values);
+    var wins = data.wins[user] || 0;
+    traces.push({
+      type: 'scattergl',
+      name: u.name + ' (' + wins + (wins == 1 ? ' win)' : ' wins)'),
+      mode: 'lines+markers',
+      connectgaps: false,
+      x: points.x,
+      y: points.y,
+    });
   }
 
-
-
   var layout = {
-    title: TIME_MODEL_NAME_MAP[data['timemodel']],
+    title: TIME_MODEL_NAME_MAP[data.timemodel],
     xaxis: {
       title: 'Date',
-      range: [one_week_ago, today],
+      range: [data.start, data.end],
       type: 'date',
       zeroline: false,
-      fixedrange: true,
-      rangeselector: {buttons: [
-        {
-          count: 7,
-          label: '1w',
-          step: 'day',
-          stepmode: 'backward'
-        },
-        {
-          count: 1,
-          label: '1m',
-          step: 'month',
-          stepmode: 'backward'
-        },
-        {
-          count: 1,
-          label: '1y',
-          step: 'year',
-          stepmode: 'backward'
-        }
-      ]},
-      rangeslider: {range: [data['start'], today]},
-      type: 'date'
     },
     yaxis: {
-      title: 'Time (s)',
+      title: normalized ? 'Score' : 'Time (s)',
+      type: log && !normalized ? 'log' : 'linear',
       autorange: true,
       fixedrange: true,
     },
     showlegend: true,
   };
 
-  Plotly.newPlot('chart', userData, layout);
+  Plotly.newPlot('chart', traces, layout);
 }
 
-
-function normalizeTimes(times) {
-  const timesByDate = {};
-  for (var time of times) {
-    if (!(time.date in timesByDate)) {
-      timesByDate[time.date] = {};
-    }
-    timesByDate[time.date][time.user] = time.seconds;
+// Concatenate a page of the series onto the pages before it
+function mergePages(data, page) {
+  if (data === null) {
+    return page;
   }
-
-  const sortedDates = Object.keys(timesByDate).sort();
-
-  const MAX_SCORE = 1.5;
-  const FAILURE_PENALTY = -2
-
-  function mkScore(mean, t, stdev) {
-    if (t < 0) {
-      return FAILURE_PENALTY;
+  for (var user in page.users) {
+    if (!(user in data.users)) {
+      data.users[user] = {name: page.users[user].name, dates: [], seconds: [], scores: []};
     }
-    if (stdev == 0) {
-      return 0;
+    for (var key of ['dates', 'seconds', 'scores']) {
+      data.users[user][key] = data.users[user][key].concat(page.users[user][key]);
     }
-
-    var score = (mean - t) / stdev;
-    if (score < -MAX_SCORE) {
-      return -MAX_SCORE;
-    }
-    if (score > MAX_SCORE) {
-      return MAX_SCORE;
-    }
-    return score;
   }
-
-  var scoresForDate = {};
-  for (var date in timesByDate) {
-    var times = Object.values(timesByDate[date]);
-    var worstTime = Math.max(...times);
-
-    // make failures 1 minute worse than the worst time
-    times = times.map(function(t) {
-      if (t >= 0) {
-        return t;
-      } else {
-        return worstTime + 60;
-      }
-    });
-
-    var q1 = times.quartile_25();
-    var q3 = times.quartile_75();
-    var stdev = times.stdev();
-    var o1 = q1 - stdev;
-    var o3 = q3 - stdev;
-
-    times = times.filter(t => t >= o1 && t <= o3);
-    var mean = times.average();
-    var stdev = times.stdev();
-
-    scoresForDate[date] = {};
-    for (user in timesByDate[date]) {
-      scoresForDate[date][user] = mkScore(mean, timesByDate[date][user], stdev);
-    }
+  for (var key in data.quartiles) {
+    data.quartiles[key] = data.quartiles[key].concat(page.quartiles[key]);
   }
-
-  const NEW_SCORE_WEIGHT = 1 - $('#plot-settings input[name="smoothing-factor"]').val();
-  const running = {};
-  const weightedScores = []; // simple list of objects
-
-  for (var date of sortedDates) {
-    for (var user in scoresForDate[date]) {
-      var score = scoresForDate[date][user];
-
-      var oldScore = score;
-      if (user in running) {
-        oldScore = running[user];
-      }
-
-      var newScore = score * NEW_SCORE_WEIGHT + oldScore * (1 - NEW_SCORE_WEIGHT);
-      running[user] = newScore;
-
-      weightedScores.push({
-        user: user,
-        date: date,
-        seconds: newScore,
-      });
-    }
+  for (var user in page.wins) {
+    data.wins[user] = (data.wins[user] || 0) + page.wins[user];
   }
-
-  return weightedScores;
+  data.end = page.end;
+  return data;
 }
 
+var currentRequest = 0;
+
 function getData() {
-  var url = '/rest-api/times/'
+  var url = '/rest-api/series/'
 
   var timeModel = $('#plot-settings input[name="time-model"]:checked').val();
   if (timeModel != undefined) {
     url += timeModel + '/';
   }
 
-  $.get(url, plotData);
+  url += '?' + $.param({
+    start: $('#plot-settings input[name="start-date"]').val(),
+    end: $('#plot-settings input[name="end-date"]').val(),
+    smooth: $('#plot-settings input[name="smoothing-factor"]').val(),
+  });
+
+  // Follow the pages to the end of the range, unless the settings change
+  var request = ++currentRequest;
+  var data = null;
+  function getPage(url) {
+    $.get(url, function(page) {
+      if (request != currentRequest) {
+        return;
+      }
+      data = mergePages(data, page);
+      if (page.next) {
+        getPage(page.next);
+      } else {
+        plotData(data);
+      }
+    });
+  }
+  getPage(url);
 }
 
 $(function() {
+  setDefaultDates();
   getData();
   $("#plot-settings").on("change", ":input", function() {
     getData();
@@ -0,0 +1,82 @@
+"""Statistics over the times, shared by /plot and the REST API."""
+
+import statistics
+from collections import defaultdict
+
+# Normalized scores are clipped to this many standard deviations, and
+# failures get a heavier penalty
+MAX_SCORE = 1.5
+FAILURE_PENALTY = -2
+
+
+def percentile(values, q):
+    """The q-th percentile (0 to 100) of some numbers, interpolated linearly
+    like numpy.percentile does by default."""
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100
+    base = int(pos)
+    if base + 1 < len(values):
+        return values[base] + (pos - base) * (values[base + 1] - values[base])
+    return values[base]
+
+
+def day_scores(user_times):
+    """Scores each time on one day by how many standard deviations it beat
+    the mean, leaving out outliers.
+
+    user_times maps users to seconds, which are negative for failures.
+    """
+    times = list(user_times.values())
+    # make failures 1 minute worse than the worst time
+    worst = max(times)
+    times = [t if t >= 0 else worst + 60 for t in times]
+
+    q1, q3 = percentile(times, 25), percentile(times, 75)
+    stdev = statistics.pstdev(times)
+    o1, o3 = q1 - stdev, q3 + stdev
+    times = [t for t in times if o1 <= t <= o3]
+    mean = statistics.mean(times)
+    stdev = statistics.pstdev(times, mean)
+
+    def score(t):
+        if t < 0:
+            return FAILURE_PENALTY
+        if stdev == 0:
+            return 0
+        return max(-MAX_SCORE, min((mean - t) / stdev, MAX_SCORE))
+
+    return {user: score(t) for user, t in user_times.items()}
+
+
+def normalized_scores(times, smooth, running=None):
+    """Exponentially smoothed daily scores for each user.
+
+    times is an iterable of (date, user, seconds), and smooth is between 0
+    (no smoothing) and 1 exclusive. Returns a dict that looks like
+    scores[user][date] = score.
+
+    running maps users to their smoothed scores before the first date, to
+    continue smoothing from. It's updated in place to the scores after the
+    last date.
+    """
+    times_by_date = defaultdict(dict)
+    for date, user, seconds in times:
+        times_by_date[date][user] = seconds
+
+    if running is None:
+        running = {}
+    weighted_scores = defaultdict(dict)
+    for date in sorted(times_by_date):
+        for user, score in day_scores(times_by_date[date]).items():
+            old_score = running.get(user)
+            if old_score is not None:
+                score = score * (1 - smooth) + old_score * smooth
+            weighted_scores[user][date] = running[user] = score
+
+    return weighted_scores
+
+
+def smoothing_days(smooth):
+    """How many days of history before a range to smooth scores over, so
+    the first day in the range isn't overweighted."""
+    return int(1 / (1 - smooth))
@@ -4,12 +4,15 @@ import json
 import time
 import logging
 import os.path
+import tempfile
 from datetime import datetime
+from io import StringIO
 
 import unittest
 from unittest.mock import patch, MagicMock
 
 from django.conf import settings
+from django.core.management import call_command
 from django.test import TestCase as DjangoTestCase
 from django.test.client import RequestFactory
 from django.urls import reverse
@@ -29,6 +32,13 @@ from crossbot.models import (
     Item,
     ItemOwnershipRecord,
     Prediction,
+    PredictionDate,
+    PredictionJob,
+    PredictionParameter,
+    PredictionRun,
+    PredictionUser,
+    DailyResult,
+    WinStreak,
 )
 from crossbot.cron import ReleaseAnnouncement, MorningAnnouncement
 from crossbot.settings import CROSSBUCKS_PER_SOLVE
@@ -37,6 +47,8 @@ from crossbot.settings import CROSSBUCKS_PER_SOLVE
 class TestCase(DjangoTestCase):
     def setUp(self):
         logging.disable(logging.CRITICAL)
+        CBUser._names.invalidate()
+        CBUser._users.invalidate()
         super().setUp()
 
     def tearDown(self):
@@ -45,9 +57,10 @@ class TestCase(DjangoTestCase):
 
 
 class MockResponse:
-    def __init__(self, text, status_code):
+    def __init__(self, text, status_code, headers=None):
         self.text = text
         self.status_code = status_code
+        self.headers = headers if headers is not None else {}
 
     def json(self):
         if type(self.text) is dict:
@@ -60,31 +73,22 @@ class MockedRequestTestCase(TestCase):
     def setUp(self):
         super().setUp()
         self.router = {}
-        self._patcher_get = patch(
-            'requests.get', side_effect=self.mocked_requests_get
+        self._patcher = patch(
+            'requests.Session.request', side_effect=self.mocked_request
         )
-        self._patcher_post = patch(
-            'requests.post', side_effect=self.mocked_requests_post
-        )
-        self._patcher_get.start()
-        self._patcher_post.start()
+        self._patcher.start()
 
     def tearDown(self):
         super().tearDown()
         self.router = {}
-        self._patcher_get.stop()
-        self._patcher_post.stop()
-
-    def mocked_requests_get(self, url, **kwargs):
-        return self.mocked_request('GET', url, **kwargs)
-
-    def mocked_requests_post(self, url, **kwargs):
-        return self.mocked_request('POST', url, **kwargs)
+        self._patcher.stop()
 
     def check_headers(self, method, url, headers):
         pass
 
-    def mocked_request(self, method, url, *, headers, params=None, data=None):
+    def mocked_request(
+            self, method, url, *, headers, params=None, data=None, timeout
+    ):
         self.check_headers(method, url, headers)
         func = self.router.get(url)
         if func:
@@ -143,6 +147,8 @@ class SlackTestCase(MockedRequestTestCase):
         self.patch(
             'django.conf.settings.CROSSBOT_MAIN_CHANNEL', 'main_channel'
         )
+        # Send queued messages right away, so tests can check them
+        self.patch('crossbot.slack.outbox.SLACK_OUTBOX_ASYNC', False)
 
     def patch(self, *args, **kwargs):
         patcher = patch(*args, **kwargs)
@@ -229,6 +235,88 @@ class SlackTestCase(MockedRequestTestCase):
 # TODO: this shouldn't be a subclass of SlackTestCase?
 # TODO: make sure these tests check that save() is properly called
 class ModelTests(SlackTestCase):
+    def test_names_for(self):
+        CBUser.from_slackid('UALICE', 'alice')
+        CBUser.from_slackid('UBOB', 'bob')
+
+        with self.assertNumQueries(1):
+            names = CBUser.names_for(['UALICE', 'UBOB', 'UALICE', 'UNOBODY'])
+        self.assertEqual(names, {'UALICE': 'Alice', 'UBOB': 'Bob'})
+
+        with self.assertNumQueries(0):
+            CBUser.names_for(['UALICE', 'UNOBODY'])
+
+        # saving a user invalidates their name
+        bob = CBUser.from_slackid('UBOB')
+        bob.slack_fullname = 'Robert'
+        bob.save()
+        self.assertEqual(CBUser.names_for(['UBOB']), {'UBOB': 'Robert'})
+
+    def test_from_slackid_cache(self):
+        CBUser.from_slackid('UALICE', 'alice')
+
+        alice = CBUser.from_slackid('UALICE', 'alice')
+        with self.assertNumQueries(0):
+            cached = CBUser.from_slackid('UALICE', 'alice')
+        self.assertEqual(cached, alice)
+
+        # callers get their own copy
+        cached.crossbucks = 100
+        self.assertEqual(CBUser.from_slackid('UALICE').crossbucks, 0)
+
+        # saving a user invalidates them
+        alice.crossbucks = 5
+        alice.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(CBUser.from_slackid('UALICE').crossbucks, 5)
+
+        # and so does a new slackname
+        CBUser.from_slackid('UALICE', 'alicia')
+        self.assertEqual(CBUser.from_slackid('UALICE').slackname, 'alicia')
+
+    def test_update_slacknames(self):
+        alice = CBUser.from_slackid('UALICE', 'alice')
+        bob = CBUser.from_slackid('UBOB', 'bob')
+        carol = CBUser.objects.create(slackid='UCAROL', slackname='carol')
+
+        # users.list comes back one user per page
+        pages = {
+            None: ('UALICE', 'page2'),
+            'page2': ('UBOB', ''),
+        }
+
+        def users_list(method, url, headers, params, data):
+            slackid, cursor = pages[params.get('cursor')]
+            return MockResponse({
+                'ok': True,
+                'members': [self.users[slackid]],
+                'response_metadata': {
+                    'next_cursor': cursor
+                }
+            }, 200)
+
+        self.router[SLACK_URL + 'users.list'] = users_list
+        self.users['UALICE']['name'] = 'alicia'
+        self.users['UBOB']['deleted'] = True
+
+        updated = CBUser.update_slacknames()
+        self.assertEqual(
+            sorted(u.slackid for u in updated), ['UALICE', 'UBOB', 'UCAROL']
+        )
+        alice.refresh_from_db()
+        bob.refresh_from_db()
+        carol.refresh_from_db()
+        self.assertEqual(alice.slackname, 'alicia')
+        self.assertIsNone(alice.deactivated)
+        self.assertIsNotNone(bob.deactivated)
+        self.assertIsNotNone(carol.deactivated)
+        self.assertEqual(carol.slackname, 'carol')
+
+        # nothing changed since, so nothing is saved or forgotten
+        CBUser.names_for(['UALICE'])
+        self.assertEqual(CBUser.update_slacknames(), [])
+        self.assertIn('UALICE', CBUser._names)
+
     def test_from_slackid(self):
         alice = CBUser.from_slackid('UALICE', 'alice')
         self.assertIsInstance(alice, CBUser)
@@ -376,16 +464,88 @@ class ModelTests(SlackTestCase):
         b_win_streaks = MiniCrosswordTime.win_streaks(bob)
         self.assertEqual(b_win_streaks, [[b2, b3]])
 
-        # check the win streaks
+        # check the win streaks, which are one lookup in the WinStreak table
+        with self.assertNumQueries(1):
+            self.assertEqual({
+                alice: 2,
+                bob: 1
+            }, MiniCrosswordTime.current_win_streaks(d[2]))
         self.assertEqual({
-            alice: [a1, a2],
-            bob: [b2]
-        }, MiniCrosswordTime.current_win_streaks(d[2]))
-        self.assertEqual({
-            bob: [b2, b3]
+            bob: 2
         }, MiniCrosswordTime.current_win_streaks(d[3]))
         self.assertEqual({}, MiniCrosswordTime.current_win_streaks(d[5]))
 
+    def test_daily_results(self):
+        alice = CBUser.from_slackid('UALICE', 'alice')
+        bob = CBUser.from_slackid('UBOB', 'bob')
+        date = parse_date('2018-01-01')
+
+        def result():
+            r = DailyResult.objects.get(game='mini', date=date)
+            return r.winning_seconds, set(r.winners.all())
+
+        alice.add_mini_crossword_time(-1, date)
+        self.assertFalse(DailyResult.objects.exists())
+
+        bob.add_mini_crossword_time(20, date)
+        self.assertEqual(result(), (20, {bob}))
+
+        alice.remove_mini_crossword_time(date)
+        alice.add_mini_crossword_time(20, date)
+        self.assertEqual(result(), (20, {alice, bob}))
+
+        bob.remove_mini_crossword_time(date)
+        self.assertEqual(result(), (20, {alice}))
+
+        self.assertEqual(MiniCrosswordTime.check_daily_results(), [])
+        DailyResult.objects.all().delete()
+        self.assertEqual(MiniCrosswordTime.check_daily_results(), [date])
+
+        call_command('daily_results', stdout=StringIO())
+        self.assertEqual(result(), (20, {alice}))
+        call_command('daily_results', '--verify', stdout=StringIO())
+
+    def test_win_streak_table(self):
+        alice = CBUser.from_slackid('UALICE', 'alice')
+        bob = CBUser.from_slackid('UBOB', 'bob')
+
+        d = {x: parse_date('2018-01-0' + str(x)) for x in range(1, 6)}
+
+        def streaks():
+            return sorted((s.user_id, s.first_date, s.last_date)
+                          for s in WinStreak.objects.all())
+
+        for x in range(1, 5):
+            alice.add_mini_crossword_time(10, d[x])
+        self.assertEqual(streaks(), [('UALICE', d[1], d[4])])
+        self.assertEqual(
+            MiniCrosswordTime.current_win_streak(alice, d[3]).length(d[3]), 3
+        )
+
+        # bob steals the middle day, splitting alice's streak
+        bob.add_mini_crossword_time(5, d[2])
+        self.assertEqual(
+            streaks(), [('UALICE', d[1], d[1]), ('UALICE', d[3], d[4]),
+                        ('UBOB', d[2], d[2])]
+        )
+        self.assertIsNone(MiniCrosswordTime.current_win_streak(alice, d[2]))
+
+        # and giving it back rejoins it
+        bob.remove_mini_crossword_time(d[2])
+        self.assertEqual(streaks(), [('UALICE', d[1], d[4])])
+
+        # a tie counts as a win for both
+        bob.add_mini_crossword_time(10, d[4])
+        self.assertEqual(
+            streaks(), [('UALICE', d[1], d[4]), ('UBOB', d[4], d[4])]
+        )
+
+        # the incremental table should match a full rebuild
+        MiniCrosswordTime.rebuild_win_streaks()
+        self.assertEqual(
+            streaks(), [('UALICE', d[1], d[4]), ('UBOB', d[4], d[4])]
+        )
+
     def test_items(self):
         # Just add one item
         alice = CBUser.from_slackid('UALICE', 'alice')
@@ -523,6 +683,128 @@ class SlackAppTests(SlackTestCase):
         alice = CBUser.objects.get(slackid='UALICE')
         self.assertEqual(len(alice.minicrosswordtime_set.all()), 2)
 
+    def test_rate_limit(self):
+        from crossbot.slack import api
+
+        limited = [
+            MockResponse({'ok': False, 'error': 'ratelimited'}, 429,
+                         {'Retry-After': '0'})
+        ]
+
+        def chat_post(method, url, headers, params, data):
+            if limited:
+                return limited.pop()
+            return self._slack_chat_post(method, url, headers, params, data)
+
+        self.router[SLACK_URL + 'chat.postMessage'] = chat_post
+        calls = api.api_stats().get('chat.postMessage', api.EndpointStats())
+
+        self.assertEqual(api.post_message('main_channel', {'text': 'hi'}), 0)
+        self.assertEqual(len(self.messages), 1)
+
+        stats = api.api_stats()['chat.postMessage']
+        self.assertEqual(stats.calls, calls.calls + 2)
+        self.assertEqual(stats.errors, calls.errors + 1)
+        self.assertEqual(stats.retries, calls.retries + 1)
+
+        # each process logs its stats every so often
+        with patch.object(api, 'SLACK_STATS_LOG_MINS', 0), \
+                patch.object(api.logger, 'info') as info:
+            api.post_message('main_channel', {'text': 'hi'})
+        logged = {c[0][1]: repr(c[0][2]) for c in info.call_args_list}
+        self.assertIn(
+            '{} retries'.format(stats.retries), logged['chat.postMessage']
+        )
+
+        # a long wait isn't worth holding up the request for
+        limited.append(
+            MockResponse({'ok': False, 'error': 'ratelimited'}, 429,
+                         {'Retry-After': '60'})
+        )
+        with self.assertRaises(ValueError):
+            api.post_message('main_channel', {'text': 'hi'})
+
+    def test_outbox(self):
+        from crossbot.slack import outbox
+        from crossbot.models import SlackOutboxMessage as Outbox
+
+        failures = [MockResponse({'ok': False, 'error': 'fatal_error'}, 200)]
+        reactions = []
+
+        def chat_post(method, url, headers, params, data):
+            if failures:
+                return failures.pop()
+            return self._slack_chat_post(method, url, headers, params, data)
+
+        def reaction_add(method, url, headers, params, data):
+            reactions.append(params)
+            return self._slack_reaction_add(method, url, headers, params, data)
+
+        self.router[SLACK_URL + 'chat.postMessage'] = chat_post
+        self.router[SLACK_URL + 'reactions.add'] = reaction_add
+
+        # the post fails, so the reaction waits for it to be retried
+        post = outbox.post_message('main_channel', {'text': 'hi'})
+        outbox.react(['fire'], post)
+        post.refresh_from_db()
+        self.assertEqual(post.state, Outbox.PENDING)
+        self.assertEqual(post.attempts, 1)
+        reaction = Outbox.objects.get(kind=Outbox.REACT)
+        self.assertEqual(reaction.state, Outbox.PENDING)
+        self.assertEqual(outbox.deliver_due(), 0)
+
+        # other channels aren't held up
+        outbox.post_response(self.RESPONSE_URL, {'text': 'ok'})
+        self.assertEqual(len(self.messages), 1)
+
+        Outbox.objects.filter(pk=post.pk).update(next_attempt=timezone.now())
+        self.assertEqual(outbox.deliver_due(), 2)
+        self.assertEqual(len(self.messages), 2)
+        self.assertEqual(
+            reactions, [{
+                'name': 'fire',
+                'channel': 'main_channel',
+                'timestamp': '1'
+            }]
+        )
+        self.assertFalse(Outbox.objects.exclude(state=Outbox.SENT).exists())
+
+    def test_reactions(self):
+        from crossbot.slack import outbox
+        from crossbot.models import SlackOutboxMessage as Outbox
+
+        errors = {'bad': 'invalid_name', 'again': 'already_reacted'}
+        reactions = []
+
+        def reaction_add(method, url, headers, params, data):
+            reactions.append(params['name'])
+            if params['name'] in errors:
+                return MockResponse({
+                    'ok': False,
+                    'error': errors[params['name']]
+                }, 200)
+            return self._slack_reaction_add(method, url, headers, params, data)
+
+        self.router[SLACK_URL + 'reactions.add'] = reaction_add
+
+        post = outbox.post_message('main_channel', {'text': 'hi'})
+        outbox.react(['fire', 'bad', 'fire', 'again'], post)
+        outbox.react(['again'], post)
+        self.assertEqual(sorted(reactions), ['again', 'bad', 'fire'])
+
+        # the failed reaction doesn't stop the others
+        states = dict(
+            Outbox.objects.filter(kind=Outbox.REACT)
+            .values_list('payload', 'state')
+        )
+        self.assertEqual(
+            states, {
+                '{"name": "fire"}': Outbox.SENT,
+                '{"name": "bad"}': Outbox.PENDING,
+                '{"name": "again"}': Outbox.SENT,
+            }
+        )
+
     def test_double_add(self):
 
         # two adds on the same day should trigger an error
@@ -607,6 +889,11 @@ class SlackAppTests(SlackTestCase):
         )
         self.assertNotIn('reported', response['text'])
 
+        from crossbot.slack.commands.sql import SNAPSHOT_TABLES
+        for table in SNAPSHOT_TABLES:
+            response = self.slack_post(text='sql select * from ' + table)
+            self.assertNotIn('reported', response['text'])
+
     @unittest.skipUnless(os.path.isfile('crossbot.db'), 'No existing db found')
     def test_query(self):
         # make sure the command tells you how to do it if there are no saved queries
@@ -634,6 +921,70 @@ class SlackAppTests(SlackTestCase):
         response = self.slack_post('query num_minis')
         int(response['text'].split('\n')[-1])
 
+    def test_query_cache(self):
+        from crossbot.slack.commands import sql
+        sql.CACHE.invalidate()
+        self.patch('crossbot.slack.commands.sql.take_snapshot')
+        self.patch(
+            'crossbot.slack.commands.sql.snapshot_version', return_value=None
+        )
+        self.patch(
+            'crossbot.slack.commands.sql.snapshot_file', return_value=(1, 1)
+        )
+        self.patch(
+            'crossbot.slack.commands.sql.POOL.run',
+            return_value=([(1, )], False)
+        )
+        run = sql.POOL.run
+
+        # the snapshot is only taken by commands if there isn't one
+        self.slack_post('query --save num_minis select count(*) from t')
+        self.slack_post('query num_minis')
+        self.assertEqual(sql.take_snapshot.call_count, 1)
+        sql.snapshot_version.return_value = 0
+
+        response = self.slack_post('query num_minis')
+        self.assertEqual(response['text'].split('\n')[-1], '1')
+        self.assertEqual(run.call_count, 1)
+
+        # adding a time doesn't retake the snapshot, so the result holds
+        self.slack_post(text='add :10')
+        self.slack_post('query num_minis')
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(sql.take_snapshot.call_count, 1)
+
+        # until the cron job takes a snapshot with the new data version
+        sql.snapshot_version.return_value = 1
+        self.slack_post('query num_minis')
+        self.assertEqual(run.call_count, 2)
+
+        # or retakes it with the same version, since tables like users can
+        # change without the version changing
+        sql.snapshot_file.return_value = (1, 2)
+        self.slack_post('query num_minis')
+        self.assertEqual(run.call_count, 3)
+
+        self.slack_post('query --no-cache num_minis')
+        self.assertEqual(run.call_count, 4)
+
+        # /sql doesn't use the cache
+        self.slack_post('sql select count(*) from t')
+        self.assertEqual(run.call_count, 5)
+
+    def test_sql_wide_rows(self):
+        self.patch('crossbot.slack.commands.sql.take_snapshot')
+        self.patch(
+            'crossbot.slack.commands.sql.POOL.run',
+            return_value=([tuple(range(12))], False)
+        )
+
+        response = self.slack_post('sql select 0, 1, 2, 3, 4, 5, 6, 7, 8, 9')
+        self.assertEqual(
+            response['text'].split('\n')[-1],
+            '0, 1, 2, 3, 4, 5, 6, 7, 8, 9, tuple was 12 elems, truncating...'
+        )
+        self.assertNotIn('reported', response['text'])
+
     def test_add_streak(self):
         # build up to a streak of 3
         self.slack_post(text='add :10 2018-08-01')
@@ -708,6 +1059,177 @@ class WebViewTests(SlackTestCase):
         self.assertIsNone(CBUser.from_slackid('UALICE', 'alice').hat)
         self.assertRedirects(response, reverse('inventory'))
 
+    def test_series_rest_api(self):
+        self.client.force_login(User.objects.create(username='UALICE'))
+        for day in (1, 2, 3):
+            self.slack_post('add :10 2018-08-0{}'.format(day))
+            self.slack_post('add :30 2018-08-0{}'.format(day), who='bob')
+        self.slack_post('add :20 2018-07-31', who='bob')
+        self.slack_post('add :30 2018-07-29')
+        self.slack_post('add :10 2018-07-29', who='bob')
+
+        url = reverse(
+            'series_rest_api', kwargs={'time_model': 'minicrossword'}
+        )
+        response = self.client.get(
+            url, {
+                'start': '2018-08-01',
+                'end': '2018-08-03',
+                'limit': 2
+            }
+        ).json()
+
+        self.assertEqual(response['end'], '2018-08-02')
+        self.assertEqual(set(response['users']), {'UALICE', 'UBOB'})
+        alice = response['users']['UALICE']
+        self.assertEqual(alice['name'], 'Alice')
+        self.assertEqual(alice['dates'], ['2018-08-01', '2018-08-02'])
+        self.assertEqual(alice['seconds'], [10, 10])
+        self.assertEqual(len(alice['scores']), 2)
+        self.assertEqual(response['quartiles']['median'], [20, 20])
+        self.assertEqual(response['wins'], {'UALICE': 2})
+
+        # the next page picks up where this one left off, smoothing scores
+        # as if the range were requested at once
+        page = self.client.get(response['next']).json()
+        self.assertEqual(page['start'], '2018-08-03')
+        self.assertEqual(page['end'], '2018-08-03')
+        self.assertIsNone(page['next'])
+
+        whole = self.client.get(
+            url, {
+                'start': '2018-08-01',
+                'end': '2018-08-03'
+            }
+        ).json()
+        for user in ('UALICE', 'UBOB'):
+            self.assertEqual(
+                response['users'][user]['scores'] +
+                page['users'][user]['scores'],
+                whole['users'][user]['scores'],
+            )
+
+        response = self.client.get(
+            url, {
+                'start': '2018-07-31',
+                'end': '2018-08-03',
+                'user': 'UBOB'
+            }
+        ).json()
+        self.assertEqual(list(response['users']), ['UBOB'])
+        self.assertEqual(response['wins'], {'UBOB': 1})
+
+        response = self.client.get(url, {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_times_rest_api(self):
+        import gzip
+
+        self.client.force_login(User.objects.create(username='UALICE'))
+        url = '/rest-api/times/minicrossword/'
+
+        response = self.client.get(url)
+        self.assertEqual(
+            json.loads(b''.join(response.streaming_content)), {
+                'timemodel': 'minicrossword',
+                'times': [],
+                'start': None,
+                'end': None
+            }
+        )
+
+        self.slack_post('add :10 2018-08-01')
+        self.slack_post('add :30 2018-08-01', who='bob')
+        self.slack_post('add :20 2018-08-02', who='bob')
+
+        with patch('crossbot.views.EXPORT_BATCH_ROWS', 2):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            data = json.loads(
+                gzip.decompress(b''.join(response.streaming_content))
+            )
+        self.assertEqual(data['start'], '2018-08-01')
+        self.assertEqual(data['end'], '2018-08-02')
+        self.assertEqual([(t['user'], t['seconds']) for t in data['times']],
+                         [('Alice', 10), ('Bob', 30), ('Bob', 20)])
+
+        response = self.client.get(url, {'format': 'ndjson'})
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(json.loads(lines[-1])['date'], '2018-08-02')
+        self.assertEqual(len(lines), 3)
+
+    def test_times_rest_api_columnar(self):
+        from crossbot import columnar, predictor
+
+        self.client.force_login(User.objects.create(username='UALICE'))
+        url = '/rest-api/times/minicrossword/'
+
+        response = self.client.get(url, {'format': 'columnar'})
+        self.assertEqual(columnar.decode(response.content).epoch, None)
+
+        self.slack_post('add :10 2018-08-01')
+        self.slack_post('add :30 2018-08-01', who='bob')
+        self.slack_post('add fail 2018-08-03', who='bob')
+
+        response = self.client.get(url, {'format': 'columnar'})
+        columns = columnar.decode(response.content)
+        self.assertEqual(columns.names, ['Alice', 'Bob'])
+        self.assertEqual(list(columns.user), [0, 1, 1])
+        self.assertEqual(list(columns.day), [0, 0, 2])
+        self.assertEqual(list(columns.seconds), [10, 30, -1])
+        # the columns start aligned, so clients can read them in place
+        self.assertEqual((len(response.content) - 3 * 4 * 3) % 4, 0)
+
+        json_response = self.client.get(url)
+        self.assertNotEqual(response['ETag'], json_response['ETag'])
+        self.assertLess(
+            len(response.content),
+            len(b''.join(json_response.streaming_content))
+        )
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'times.cbt')
+            call_command('export_times', path, stdout=StringIO())
+            times = list(predictor.data_columnar(path))
+        self.assertEqual(
+            [(t.user.pk, str(t.date), t.seconds) for t in times],
+            [
+                ('UALICE', '2018-08-01', 10),
+                ('UBOB', '2018-08-01', 30),
+                ('UBOB', '2018-08-03', -1),
+            ]
+        )
+        self.assertEqual(predictor.encode(times).stan_data['Ds'], 2)
+
+    def test_rest_api_conditional(self):
+        self.client.force_login(User.objects.create(username='UALICE'))
+        self.slack_post('add :10 2018-08-01')
+
+        for day, url in enumerate(['/rest-api/times/', '/rest-api/series/']):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            last_modified = response['Last-Modified']
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+            self.assertEqual(response.status_code, 304)
+
+            # other games have their own versions
+            self.slack_post('-s add 1:00 2018-08-0{}'.format(day + 1))
+            self.assertEqual(EasySudokuTime.all_times().count(), day + 1)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            self.slack_post('delete 2018-08-01')
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.slack_post('add :10 2018-08-01')
+
 
 class AnnouncementTests(SlackTestCase):
     def setUp(self):
@@ -765,6 +1287,177 @@ class MiscTests(TestCase):
             'alice, bob, and charlie', comma_and(['alice', 'bob', 'charlie'])
         )
 
+    def test_hot_queries_use_indexes(self):
+        call_command('explain_hot_queries', '--check', stdout=StringIO())
+
+    def test_startup_is_lazy(self):
+        call_command(
+            'import_time', '--repeat', '1', '--check', stdout=StringIO()
+        )
+
+    def test_parser_dispatch(self):
+        from crossbot.slack.handler import PARSER
+        from crossbot.slack.parser import ParserException
+        from crossbot.management.commands.bench_parser import SAMPLE_COMMANDS
+
+        def parse(parse_args, string):
+            try:
+                return vars(parse_args(string.split()))
+            except ParserException as e:
+                return str(e)
+
+        # dispatching straight to the subcommand's parser gives the same
+        # result as running the whole parser
+        for string in SAMPLE_COMMANDS + ['', 'add', 'sql -- -h']:
+            self.assertEqual(
+                parse(PARSER._parse_args, string),
+                parse(PARSER.parser.parse_args, string),
+                string,
+            )
+
+        with self.assertRaises(ParserException) as cm:
+            PARSER.parse('help add')
+        self.assertIn('crossbot add', str(cm.exception))
+
+    def test_lazy_module(self):
+        from crossbot.util import LazyModule
+
+        setup = MagicMock()
+        lazy = LazyModule('json', 'json.decoder', setup=setup)
+        setup.assert_not_called()
+        self.assertEqual(lazy.dumps([1]), '[1]')
+        self.assertIs(lazy.decoder, json.decoder)
+        setup.assert_called_once_with()
+
+    def test_sql_sandbox(self):
+        import sqlite3
+        from crossbot.sql_sandbox import SandboxPool, QueryTimeout
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'test.db')
+            with sqlite3.connect(path) as con:
+                con.execute('create table t (x integer)')
+                con.execute('create table secret (x integer)')
+                con.executemany(
+                    'insert into t values (?)', [(i, ) for i in range(1000)]
+                )
+
+            pool = SandboxPool(
+                path, ['t'], processes=1, max_queries=2, timeout=0.2
+            )
+            try:
+                self.assertEqual(
+                    pool.run('select x from t where x < ?', [3], max_rows=2),
+                    ([(0, ), (1, )], True)
+                )
+                self.assertEqual(
+                    pool.run('select x from t where x < ?', [2], max_rows=2),
+                    ([(0, ), (1, )], False)
+                )
+                # rows past the byte budget aren't returned
+                self.assertEqual(
+                    pool.run("select 'abcd' from t", max_bytes=10),
+                    ([('abcd', ), ('abcd', )], True)
+                )
+                # but the first row is returned even if it alone is over
+                self.assertEqual(
+                    pool.run("select 'abcd' from t", max_bytes=2),
+                    ([('abcd', )], True)
+                )
+                with self.assertRaises(QueryTimeout):
+                    pool.run('select count(*) from t a, t b, t c')
+                # the worker is still usable after a timeout
+                self.assertEqual(
+                    pool.run('select count(*) from t'), ([(1000, )], False)
+                )
+                with self.assertRaises(sqlite3.DatabaseError):
+                    pool.run('select * from secret')
+                with self.assertRaises(sqlite3.DatabaseError):
+                    pool.run('delete from t')
+            finally:
+                pool.recycle()
+
+    def test_sql_snapshot(self):
+        import sqlite3
+        from crossbot.sql_sandbox import (
+            SandboxPool, take_snapshot, snapshot_age
+        )
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'live.db')
+            snapshot = os.path.join(d, 'snapshot.db')
+            with sqlite3.connect(path) as con:
+                con.execute('create table t (x integer)')
+                con.execute('create table secret (x integer)')
+                con.execute('insert into t values (1)')
+
+            self.assertIsNone(snapshot_age(snapshot))
+            tables = {'doubled': 'select x, 2 * x as y from live.t'}
+            take_snapshot(path, snapshot, tables)
+            self.assertLess(snapshot_age(snapshot), 60)
+            self.assertEqual(sorted(os.listdir(d)), ['live.db', 'snapshot.db'])
+
+            pool = SandboxPool(
+                snapshot, tables, processes=1, max_queries=10, timeout=1
+            )
+            try:
+                self.assertEqual(
+                    pool.run('select * from doubled'), ([(1, 2)], False)
+                )
+
+                # new data only shows up once the snapshot is retaken
+                with sqlite3.connect(path) as con:
+                    con.execute('insert into t values (2)')
+                self.assertEqual(
+                    pool.run('select count(*) from doubled'), ([(1, )], False)
+                )
+                take_snapshot(path, snapshot, tables)
+                self.assertEqual(
+                    pool.run('select count(*) from doubled'), ([(2, )], False)
+                )
+            finally:
+                pool.recycle()
+
+    def test_stan_cache(self):
+        from crossbot import stan_cache
+
+        compiled = []
+
+        def compiler(code):
+            compiled.append(code)
+            return {'code': code}
+
+        with tempfile.TemporaryDirectory() as d, \
+                patch.object(stan_cache, 'PREDICTOR_CACHE_DIR', d):
+            model = stan_cache.get_model('a', compiler=compiler)
+            self.assertEqual(model, {'code': 'a'})
+            self.assertEqual(
+                stan_cache.get_model('a', compiler=compiler), model
+            )
+            self.assertEqual(compiled, ['a'])
+
+            # a corrupt model is evicted and recompiled
+            path = stan_cache.model_path('a')
+            with open(path, 'wb') as f:
+                f.write(b'\x80\x04garbage')
+            with self.assertRaises(stan_cache.CorruptModelError):
+                stan_cache.read(path)
+            self.assertEqual(
+                stan_cache.get_model('a', compiler=compiler), model
+            )
+            self.assertEqual(compiled, ['a', 'a'])
+
+            # but a failed compile leaves the cached model alone
+            def fail(code):
+                raise RuntimeError('boom')
+
+            with self.assertRaises(RuntimeError):
+                stan_cache.get_model('a', force=True, compiler=fail)
+            self.assertEqual(stan_cache.read(path), model)
+            self.assertFalse(
+                [f for f in os.listdir(d) if f.startswith('.tmp.')]
+            )
+
 
 class PredictorTests(SlackTestCase):
     data = {
@@ -802,9 +1495,248 @@ class PredictorTests(SlackTestCase):
         u1, u2 = CBUser.from_slackid("U1"), CBUser.from_slackid("U2")
         self.assertLess(users[u1].skill, users[u2].skill)
 
+    def test_encode(self):
+        import crossbot.predictor as p
+        encoding = p.encode(p.data())
+        self.assertIs(p.encode(encoding), encoding)
+
+        self.assertEqual([u.slackid for u in encoding.users], ['U1', 'U2'])
+        self.assertEqual(
+            encoding.dates,
+            [parse_date("2018-01-0" + str(i)) for i in range(1, 7)]
+        )
+
+        stan_data = encoding.stan_data
+        self.assertEqual(stan_data['uids'], [2, 1, 2, 1, 2, 1, 2, 1, 2, 1])
+        self.assertEqual(stan_data['dates'], [1, 2, 2, 3, 3, 4, 4, 5, 5, 6])
+        self.assertEqual(stan_data['nth'], [2, 2, 3, 3, 4, 4, 5, 5, 6, 6])
+        self.assertEqual(
+            (stan_data['Us'], stan_data['Ds'], stan_data['Ss']), (2, 6, 10)
+        )
+
+    def test_summarize(self):
+        import numpy as np
+        import crossbot.predictor as p
+        draws = np.array([[1.0, 10.0], [2.0, 10.0], [3.0, 40.0],
+                          [6.0, 20.0], [8.0, 20.0]])
+        mean, lo, hi = p.summarize(draws)
+        self.assertEqual(mean.tolist(), [4.0, 20.0])
+        self.assertEqual(lo.tolist(), [2.0, 10.0])
+        self.assertEqual(hi.tolist(), [2.0, 0.0])
+
+    def test_incremental(self):
+        import crossbot.predictor as p
+        self.assertIsNone(p.last_run())
+        self.assertEqual(p.warm_start(p.data(), 2), 'random')
+
+        u1 = CBUser.from_slackid("U1")
+        run = PredictionRun.objects.create(finished=timezone.now())
+        PredictionUser(
+            run=run, user=u1, skill=0.5, skill_25=0.1, skill_75=0.1
+        ).save()
+        PredictionParameter(
+            run=run,
+            when_run=timezone.now(),
+            **{
+                f.name: 1.0
+                for f in PredictionParameter._meta.fields
+                if f.get_internal_type() == 'FloatField'
+            }
+        ).save()
+        self.assertFalse(p.changed_since(p.last_run().when_run))
+
+        encoding = p.encode(
+            p.data(), since=parse_date("2018-01-05"), priors={'U1': (0.5, 0.2)}
+        )
+        stan_data = encoding.stan_data
+        self.assertEqual([u.slackid for u in encoding.users], ['U1', 'U2'])
+        self.assertEqual(stan_data['Ss'], 3)
+        # play counts still include the days before the window
+        self.assertEqual(stan_data['nth'], [5, 6, 6])
+        self.assertEqual(stan_data['has_prior'], [1, 0])
+        self.assertEqual(stan_data['skill_prior_mu'], [0.5, 0.0])
+        self.assertEqual(stan_data['skill_prior_sd'], [0.2, 1.0])
+        self.assertEqual(stan_data['skill_dev_prior'], 1.0)
+
+        init = p.warm_start(encoding, 2)
+        self.assertEqual(len(init), 2)
+        self.assertEqual(init[0]['skill_effect'], [0.5, 0.0])
+        self.assertEqual(init[0]['mu'], 1.0)
+
+        u1.add_mini_crossword_time(30, parse_date("2018-01-07"))
+        self.assertTrue(p.changed_since(p.last_run().when_run))
+
+    def test_save(self):
+        import crossbot.predictor as p
+        encoding = p.encode(p.data())
+
+        def make_model(offset):
+            recs = [
+                Prediction(time=t, prediction=offset, residual=offset)
+                for t in encoding.times
+            ]
+            dates = [
+                PredictionDate(
+                    date=d,
+                    difficulty=offset,
+                    difficulty_25=offset,
+                    difficulty_75=offset
+                ) for d in encoding.dates
+            ]
+            users = [
+                PredictionUser(
+                    user=u, skill=offset, skill_25=offset, skill_75=offset
+                ) for u in encoding.users
+            ]
+            params = PredictionParameter(
+                when_run=timezone.now(),
+                **{
+                    f.name: offset
+                    for f in PredictionParameter._meta.fields
+                    if f.get_internal_type() == 'FloatField'
+                }
+            )
+            return recs, dates, users, params
+
+        model = make_model(1.0)
+        run1 = p.save(model)
+        self.assertEqual(model, p.load())
+
+        # saving again makes a new current run, and keeps the old one
+        model2 = make_model(2.0)
+        run2 = p.save(model2)
+        self.assertEqual(model2, p.load())
+        self.assertEqual(model, p.load(run1))
+        self.assertEqual(PredictionRun.current(), run2)
+        self.assertEqual(PredictionParameter.current().get().lp, 2.0)
+
+        # only the newest runs are kept
+        p.collect_runs(keep=1)
+        self.assertEqual(list(PredictionRun.objects.all()), [run2])
+        self.assertEqual(PredictionParameter.objects.count(), 1)
+
+        # a windowed model leaves the rows before the window alone
+        since = parse_date("2018-01-05")
+        model3 = make_model(3.0)
+        model3 = (
+            [r for r in model3[0] if r.time.date >= since],
+            [d for d in model3[1] if d.date >= since],
+            model3[2],
+            model3[3],
+        )
+        p.save(model3, since=since)
+        recs = p.load()[0]
+        self.assertEqual(len(recs), 10)
+        self.assertEqual(
+            [r.prediction for r in recs], [2.0] * 7 + [3.0] * 3
+        )
+
     def test_cron(self):
         from crossbot.cron import Predictor
         Predictor().do()
+        call_command(
+            'predictor_worker', '--once', '--nice=0', stdout=StringIO()
+        )
+        job = PredictionJob.latest()
+        self.assertEqual(job.state, PredictionJob.FINISHED)
+        self.assertEqual(job.run, PredictionRun.current())
+
+        # nothing changed, so the next run doesn't queue another fit
+        Predictor().do()
+        self.assertEqual(PredictionJob.latest(), job)
+
+    def test_jobs(self):
+        import crossbot.predictor as p
+        from crossbot.cron import Predictor
+
+        Predictor().do()
+        Predictor().do()
+        job = PredictionJob.latest()
+        self.assertEqual(job.state, PredictionJob.QUEUED)
+        self.assertEqual(PredictionJob.objects.count(), 1)
+        self.assertEqual(PredictionJob.enqueue(), job)
+
+        # failures are recorded on the job, and the worker carries on
+        with patch.object(p, 'get_model'), \
+                patch.object(p, 'fit', side_effect=RuntimeError('boom')):
+            call_command(
+                'predictor_worker',
+                '--once',
+                '--nice=0',
+                stdout=StringIO(),
+                stderr=StringIO()
+            )
+        job.refresh_from_db()
+        self.assertEqual(job.state, PredictionJob.FAILED)
+        self.assertIn('boom', job.error)
+        self.assertIsNone(PredictionJob.claim())
+
+        response = self.slack_post(text='predictor details')
+        self.assertIn('*Latest job*: failed', response['text'])
+
+    def test_window_priors(self):
+        import crossbot.predictor as p
+        fitted = []
+
+        def fit(encoding, quiet=False, warm=False):
+            fitted.append(encoding.stan_data)
+
+        def extract_model(encoding, fm):
+            # like a real fit, the posteriors are narrower than the priors
+            users = [
+                PredictionUser(
+                    user=user, skill=0.0, skill_25=0.01, skill_75=0.01
+                ) for user in encoding.users
+            ]
+            params = PredictionParameter(
+                when_run=encoding.as_of,
+                **{
+                    f.name: 1.0
+                    for f in PredictionParameter._meta.fields
+                    if f.get_internal_type() == 'FloatField'
+                }
+            )
+            return [], [], users, params
+
+        def run(since):
+            PredictionJob.enqueue(since=parse_date(since))
+            p.run_job(PredictionJob.claim())
+
+        priors = {'U1': (0.5, 0.2), 'U2': (-0.5, 0.3)}
+        with patch.object(p, 'fit', fit), \
+                patch.object(p, 'extract_model', extract_model), \
+                patch.object(p, 'fit_priors', return_value=priors):
+            # refitting the same window reuses the priors, which never saw
+            # the window's times, instead of the last posterior
+            run("2018-01-05")
+            run("2018-01-05")
+            self.assertEqual(p.fit_priors.call_count, 1)
+            self.assertEqual(fitted[0]['skill_prior_sd'], [0.2, 0.3])
+            self.assertEqual(fitted[1]['skill_prior_sd'], [0.2, 0.3])
+            self.assertEqual(fitted[1]['skill_prior_mu'], [0.5, -0.5])
+
+            # a window from a new date needs priors fitted up to that date
+            run("2018-01-06")
+            self.assertEqual(p.fit_priors.call_count, 2)
+        self.assertEqual(
+            PredictionRun.current().since, parse_date("2018-01-06")
+        )
+
+    def test_stale_jobs(self):
+        from datetime import timedelta
+
+        PredictionJob.enqueue()
+        job = PredictionJob.claim()
+        self.assertEqual(PredictionJob.fail_stale(timedelta(hours=1)), 0)
+        self.assertEqual(PredictionJob.fail_stale(timedelta(0)), 1)
+
+        # the abandoned worker can't finish the job after all
+        self.assertFalse(job.finish(run=PredictionRun.objects.create()))
+        self.assertEqual(job.state, PredictionJob.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.state, PredictionJob.FAILED)
+        self.assertEqual(job.error, 'Abandoned by its worker')
+        self.assertIsNone(job.run)
 
     def test_announcement(self):
         self.run_predictor()
@@ -8,6 +8,12 @@ urlpatterns = [
     path('slack/', views.slash_command, name='slash_command'),
     path('rest-api/times/<time_model>/', views.times_rest_api),
     path('rest-api/times/', views.times_rest_api),
+    path(
+        'rest-api/series/<time_model>/',
+        views.series_rest_api,
+        name='series_rest_api'
+    ),
+    path('rest-api/series/', views.series_rest_api),
     path(
         'plot/',
         login_required(
@@ -1,3 +1,9 @@
+import importlib
+import threading
+import time
+from collections import OrderedDict
+
+
 def comma_and(strings):
     # copy so we can get length and mutate
     strings = list(strings)
@@ -12,3 +18,84 @@ def comma_and(strings):
     assert n > 2
     strings[-1] = 'and ' + strings[-1]
     return ', '.join(strings)
+
+
+class LRUCache:
+    """A thread-safe mapping that forgets its least recently used keys.
+
+    Holds at most maxsize keys, each for at most ttl seconds. Missing and
+    expired keys are returned as default by get.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def __contains__(self, key):
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        """Forget keys, or everything if no keys are given."""
+        with self._lock:
+            if not keys:
+                self._data.clear()
+            for key in keys:
+                self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LazyModule:
+    """Stands in for a module that's only imported once it's used.
+
+    For heavy dependencies like numpy, matplotlib and pystan, which most
+    processes never touch. The submodules are imported along with the
+    module, and setup is called just before.
+    """
+
+    def __init__(self, name, *submodules, setup=None):
+        self._name = name
+        self._submodules = submodules
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                if self._setup is not None:
+                    self._setup()
+                module = importlib.import_module(self._name)
+                for submodule in self._submodules:
+                    importlib.import_module(submodule)
+                self._module = module
+            return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self._name)
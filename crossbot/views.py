@@ -1,23 +1,35 @@
+import datetime
 import hashlib
 import hmac
+import json
 import time
 import logging
+from collections import defaultdict
 
+from crossbot import columnar, stats
 from crossbot.util import comma_and
 
 from django import forms
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.db.models import Count
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, JsonResponse,
+    StreamingHttpResponse
+)
 from django.shortcuts import render, redirect
 from django.utils import timezone
 from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
 
 from .slack.handler import handle_slash_command
-from .models import MiniCrosswordTime, CrosswordTime, EasySudokuTime, Item
+from .models import (
+    CBUser, DailyResult, DataVersion, MiniCrosswordTime, CrosswordTime,
+    EasySudokuTime, Item
+)
 
 logger = logging.getLogger(__name__)
 
@@ -67,39 +79,250 @@ TIME_MODELS = {
 }
 
 
+# How long browsers can use the times without checking if they changed.
+# After that, they get a 304 unless the game's DataVersion went up.
+REST_MAX_AGE = 60
+
+
+def _data_version(time_model):
+    if time_model not in TIME_MODELS:
+        return None
+    return DataVersion.of(TIME_MODELS[time_model].SLUG)
+
+
+def _times_etag(request, time_model='minicrossword'):
+    version = _data_version(time_model)
+    etag = version and '{}-{}'.format(time_model, version.version)
+    # Each format of the same times gets its own etag
+    export_format = request.GET.get('format')
+    if etag and export_format:
+        etag = '{}-{}'.format(etag, export_format)
+    return etag
+
+
+def _times_last_modified(request, time_model='minicrossword'):
+    version = _data_version(time_model)
+    return version and version.updated
+
+
+def _series_etag(request, time_model='minicrossword'):
+    # The default date range moves every day
+    etag = _times_etag(request, time_model)
+    return etag and '{}-{}'.format(etag, timezone.localdate())
+
+
+def _series_last_modified(request, time_model='minicrossword'):
+    last_modified = _times_last_modified(request, time_model)
+    today = timezone.localtime().replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return last_modified and max(last_modified, today)
+
+
+# Rows are sent in batches this big, so gzip has something to work with
+EXPORT_BATCH_ROWS = 1000
+
+
+def _export_times(game, time_model, ndjson):
+    """Yields a game's times as JSON (or NDJSON) text, a batch at a time,
+    without loading them all into memory."""
+    names = CBUser.names_for(
+        game.all_times().values_list('user_id', flat=True).distinct()
+    )
+    rows = game.all_times().order_by('date', 'pk').values_list(
+        'user_id', 'date', 'seconds', 'timestamp'
+    ).iterator(chunk_size=EXPORT_BATCH_ROWS)
+
+    if not ndjson:
+        yield '{{"timemodel": {}, "times": ['.format(json.dumps(time_model))
+
+    start = end = None
+    batch = []
+    for user_id, date, seconds, timestamp in rows:
+        row = json.dumps({
+            'user': names.get(user_id) or user_id,
+            'date': date.isoformat(),
+            'seconds': seconds,
+            'timestamp': timestamp and timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        if ndjson:
+            batch.append(row + '\n')
+        else:
+            batch.append(row if start is None else ', ' + row)
+
+        start = start or date
+        end = date
+        if len(batch) == EXPORT_BATCH_ROWS:
+            yield ''.join(batch)
+            batch = []
+
+    if not ndjson:
+        batch.append(
+            '], "start": {}, "end": {}}}'.format(
+                json.dumps(start and start.isoformat()),
+                json.dumps(end and end.isoformat()),
+            )
+        )
+    yield ''.join(batch)
+
+
 @login_required
 @gzip_page
-@cache_control(max_age=3600)
+@cache_control(private=True, max_age=REST_MAX_AGE)
+@condition(etag_func=_times_etag, last_modified_func=_times_last_modified)
 def times_rest_api(request, time_model='minicrossword'):
+    """Streams every time for a game as JSON, or one time per line with
+    ?format=ndjson. ?format=columnar sends the much smaller encoding from
+    crossbot.columnar instead."""
     if request.method != 'GET':
         return HttpResponseBadRequest("Bad method")
 
-    # end_date = datetime.date.today()
-    # if 'end' in request.GET:
-    #     end_date = datetime.datetime.strptime(request.GET['end'], '%Y-%m-%d').date()
+    if time_model not in TIME_MODELS:
+        raise Http404('No such game')
+
+    if request.GET.get('format') == 'columnar':
+        return HttpResponse(
+            columnar.export(TIME_MODELS[time_model], time_model),
+            content_type='application/octet-stream'
+        )
+
+    ndjson = request.GET.get('format') == 'ndjson'
+    return StreamingHttpResponse(
+        _export_times(TIME_MODELS[time_model], time_model, ndjson),
+        content_type='application/x-ndjson' if ndjson else 'application/json'
+    )
+
+
+# By default, series_rest_api returns the last SERIES_DAYS days, in pages of
+# at most SERIES_MAX_PAGE_DAYS days
+SERIES_DAYS = 30
+SERIES_MAX_PAGE_DAYS = 366
+
+
+def _date_param(request, name, default):
+    value = request.GET.get(name)
+    if not value:
+        return default
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
 
-    # start_date = end_date - datetime.timedelta(days=10)
-    # if 'start' in request.GET:
-    #     start_date = datetime.datetime.strptime(request.GET['start'], '%Y-%m-%d').date()
 
-    times = (
-        TIME_MODELS[time_model].all_times().order_by('date')
-        .select_related('user')
+@login_required
+@gzip_page
+@cache_control(private=True, max_age=REST_MAX_AGE)
+@condition(etag_func=_series_etag, last_modified_func=_series_last_modified)
+def series_rest_api(request, time_model='minicrossword'):
+    """Summarizes a game's times over a date range, for plotting.
+
+    GET parameters (all optional):
+        start, end: The date range, YYYY-MM-DD. Defaults to the last
+            SERIES_DAYS days.
+        user: Only return the series for these slackids (can be repeated).
+        smooth: Smoothing factor for the normalized scores, 0 to 0.95.
+        limit: At most this many days are returned at a time. If the range
+            is longer, "next" is the url of the next page.
+        seed: Set by "next" to the running scores at the end of the previous
+            page, so paged scores match those of a single request.
+
+    Returns, for the dates in the page, each user's times and normalized
+    scores, the quartiles of each day's (successful) times, and how many
+    days each user won.
+    """
+    if request.method != 'GET':
+        return HttpResponseBadRequest("Bad method")
+
+    if time_model not in TIME_MODELS:
+        raise Http404('No such game')
+    game = TIME_MODELS[time_model]
+
+    try:
+        end = _date_param(request, 'end', timezone.localdate())
+        start = _date_param(
+            request, 'start', end - datetime.timedelta(days=SERIES_DAYS - 1)
+        )
+        smooth = float(request.GET.get('smooth', 0.7))
+        limit = int(request.GET.get('limit', SERIES_MAX_PAGE_DAYS))
+        seed = request.GET.get('seed')
+        seed = seed and {
+            user: float(score)
+            for user, score in json.loads(seed).items()
+        }
+    except (ValueError, AttributeError) as e:
+        return HttpResponseBadRequest(str(e))
+    if not 0 <= smooth <= 0.95:
+        return HttpResponseBadRequest('smooth should be between 0 and 0.95')
+    if start > end:
+        return HttpResponseBadRequest('start should be before end')
+
+    limit = max(1, min(limit, SERIES_MAX_PAGE_DAYS))
+    page_end = min(end, start + datetime.timedelta(days=limit - 1))
+    users = set(request.GET.getlist('user'))
+
+    # Scores are normalized against everyone's times that day, and smoothed
+    # over the days before the range, or continue from the previous page
+    smooth_start = start
+    if seed is None:
+        smooth_start -= datetime.timedelta(days=stats.smoothing_days(smooth))
+    times = list(
+        game.all_times().filter(date__gte=smooth_start, date__lte=page_end)
+        .order_by('date').values_list('date', 'user_id', 'seconds')
+    )
+    running = dict(seed or {})
+    scores = stats.normalized_scores(times, smooth, running)
+
+    series = defaultdict(lambda: {'dates': [], 'seconds': [], 'scores': []})
+    times_by_date = defaultdict(list)
+    for date, user, seconds in times:
+        if date < start:
+            continue
+        if seconds > 0:
+            times_by_date[date].append(seconds)
+        if users and user not in users:
+            continue
+        series[user]['dates'].append(date)
+        series[user]['seconds'].append(seconds)
+        series[user]['scores'].append(scores[user][date])
+
+    quartiles = {'dates': [], 'q25': [], 'median': [], 'q75': []}
+    for date, day_times in sorted(times_by_date.items()):
+        quartiles['dates'].append(date)
+        quartiles['q25'].append(stats.percentile(day_times, 25))
+        quartiles['median'].append(stats.percentile(day_times, 50))
+        quartiles['q75'].append(stats.percentile(day_times, 75))
+
+    winners = DailyResult.winners.through.objects.filter(
+        dailyresult__game=game.SLUG,
+        dailyresult__date__gte=start,
+        dailyresult__date__lte=page_end,
     )
+    if users:
+        winners = winners.filter(cbuser__in=users)
+    wins = dict(
+        winners.values_list('cbuser').annotate(wins=Count('pk')).order_by()
+    )
+
+    names = CBUser.names_for(set(series) | set(wins))
+    for user, user_series in series.items():
+        user_series['name'] = names.get(user) or user
+
+    next_url = None
+    if page_end < end:
+        params = request.GET.copy()
+        params['start'] = page_end + datetime.timedelta(days=1)
+        params['end'] = end
+        params['seed'] = json.dumps({
+            user: score
+            for user, score in running.items() if not users or user in users
+        })
+        next_url = request.path + '?' + params.urlencode()
 
     return JsonResponse({
-        'times': [{
-            'user': str(t.user),
-            'date': t.date,
-            'seconds': t.seconds,
-            'timestamp': t.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-        } for t in times],
-        'timemodel':
-        time_model,
-        'start':
-        times[0].date,
-        'end':
-        times[len(times) - 1].date,
+        'timemodel': time_model,
+        'start': start,
+        'end': page_end,
+        'users': series,
+        'quartiles': quartiles,
+        'wins': wins,
+        'next': next_url,
     })
 
 
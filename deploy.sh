@@ -10,3 +10,6 @@ echo "Backed up to $backup"
 
 # make sure to include settings/prod.py first, as it's later excluded from .gitignore, and the first pattern wins
 $rsync --include settings/prod.py --exclude-from .gitignore --exclude .git . uwplse.org:/var/www/crossbot
+
+# compile the predictor model now, instead of on the first prediction
+ssh uwplse.org "cd /var/www/crossbot && make warm_predictor_cache"
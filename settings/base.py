@@ -199,7 +199,9 @@ CRON_CLASSES = [
     "crossbot.cron.ReleaseAnnouncement",
     "crossbot.cron.MorningAnnouncement",
     "crossbot.cron.Predictor",
-    "crossbot.cron.SlacknameUpdater"
+    "crossbot.cron.SlacknameUpdater",
+    "crossbot.cron.SlackOutbox",
+    "crossbot.cron.SqlSnapshot",
 ]
 
 DJANGO_CRON_LOCK_BACKEND = "django_cron.backends.lock.file.FileLock"